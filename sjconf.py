@@ -1,10 +1,12 @@
-import re, os, time, shutil, tarfile, glob
-import imp
+import re, os, time, glob, json
 import sys
 
 from sjconfparts.type import *
 from sjconfparts.plugin import *
 from sjconfparts.conf import *
+from sjconfparts.resolver import *
+from sjconfparts.cache import *
+from sjconfparts.service import *
 from sjconfparts.exceptions import *
 from functools import reduce
 
@@ -13,6 +15,24 @@ class SJConf:
 
     DEFAULT_SJCONF_FILE_NAME = "/etc/sjconf/sjconf.conf"
 
+    # Batch operations: method to call and its arguments, indexed by both the
+    # method name and the command line option name
+    BATCH_OPERATIONS = {
+        "set": ("set", ("section", "key", "value")),
+        "list_add": ("list_add", ("section", "key", "value")),
+        "add-to-list": ("list_add", ("section", "key", "value")),
+        "list_remove": ("list_remove", ("section", "key", "value")),
+        "remove-from-list": ("list_remove", ("section", "key", "value")),
+        "sequence_add": ("sequence_add", ("section", "key", "value")),
+        "add-to-sequence": ("sequence_add", ("section", "key", "value")),
+        "sequence_remove": ("sequence_remove", ("section", "key", "value")),
+        "remove-from-sequence": ("sequence_remove", ("section", "key", "value")),
+        "delete_key": ("delete_key", ("section", "key")),
+        "delete-key": ("delete_key", ("section", "key")),
+        "delete_section": ("delete_section", ("section",)),
+        "delete-section": ("delete_section", ("section",)),
+    }
+
     def __init__(
         self, sjconf_file_path=DEFAULT_SJCONF_FILE_NAME, verbose=False, logger=None
     ):
@@ -22,9 +42,26 @@ class SJConf:
 
         self.backup_dir = os.path.realpath(
             self.confs_internal["sjconf"]["conf"]["backup_dir"]
-            + "/"
-            + time.strftime("%F-%R:%S", time.localtime())
         )
+        if "backup_compression" in self.confs_internal["sjconf"]["conf"]:
+            self.backup_compression = self.confs_internal["sjconf"]["conf"][
+                "backup_compression"
+            ]
+        else:
+            self.backup_compression = "none"
+        # Created on first use, see backup_store
+        self._backup_store = None
+        # When backups are compressed: "sync" or "detached"
+        if "backup_archive" in self.confs_internal["sjconf"]["conf"]:
+            self.backup_archive = self.confs_internal["sjconf"]["conf"][
+                "backup_archive"
+            ]
+        else:
+            self.backup_archive = "sync"
+        # Parsed on first use, see backup_retention
+        self._backup_retention = None
+        self.backup_id = None
+        self.backup_hashes = []
         self.etc_dir = os.path.realpath(
             self.confs_internal["sjconf"]["conf"]["etc_dir"]
         )
@@ -32,8 +69,22 @@ class SJConf:
             self.confs_internal["sjconf"]["conf"]["base_dir"]
         )
 
-        self.confs = None
+        self.confs = Resolver()
+        if "internal_config_path" in self.confs_internal["sjconf"]["conf"]:
+            internal_config_path = os.path.realpath(
+                self.confs_internal["sjconf"]["conf"]["internal_config_path"]
+            )
+            self.parse_cache = ParseCache(internal_config_path + "/conf_cache")
+            self.plugin_manifest = PluginManifest(
+                internal_config_path + "/plugins.json"
+            )
+        else:
+            self.parse_cache = None
+            self.plugin_manifest = None
         self.plugins_list = None
+        self.plugins_graph = None
+
+        self.service_executor = ServiceExecutor(logger=self._logger)
 
         self.temp_file_path = "/tmp/sjconf_tempfile.conf"
 
@@ -54,14 +105,20 @@ class SJConf:
             "profile": (".conf",),
         }
 
+        # Compiled templates are cached next to the templates
+        self.template_engines = {}
+        self.template_cache_path = self.files_path["template"] + ".cache"
+
         self.verbose = verbose
         self.logger = logger
 
     def conf(self, typed=False):
-        self._load_confs()
-        conf = self.conf_base()
-        self._load_conf_local()
-        conf.update(self.confs["local"])
+        """Returns the merged configuration.
+
+        The returned Conf is a copy of the merged view of the resolver, so
+        callers may modify it, and set types on it, freely.
+        """
+        conf = self._conf_copy(self._conf_merged())
         if typed:
             conf = self.conf_typed(conf)
         return conf
@@ -69,13 +126,16 @@ class SJConf:
     def conf_typed(self, conf=None):
         self._plugins_load()
         if conf is None:
-            conf = self.conf()
+            conf = self._conf_merged()
         # We want a normal dictionary
         conf = dict(conf)
         for section_name, section in conf.items():
             conf[section_name] = dict(section)
+        sections_index = Resolver.index_sections(conf)
         for plugin in self.plugins_list:
-            plugin.set_conf(self.plugin_conf(plugin.name(), conf))
+            plugin.set_conf(
+                self._sections_conf(conf, sections_index.get(plugin.name(), ()))
+            )
             for (section_name, section) in plugin.conf.items():
 
                 def section_getitem(*args, **kw):
@@ -101,23 +161,49 @@ class SJConf:
         return conf
 
     def conf_base(self, typed=False):
-        self._load_conf_base()
-        conf = Conf(self.confs["base"])
-        self._load_conf_profile()
-        if "profile" in self.confs:
-            conf.update(self.confs["profile"])
+        """Returns the merged base and profile configurations, as a copy."""
+        conf = self._conf_copy(self._conf_base_merged())
         if typed:
             conf = self.conf_typed(conf)
         return conf
 
     def plugin_conf(self, plugin_name, conf=None):
+        """Returns the sections of @plugin_name, from the merged conf by default.
+
+        The sections of the merged conf are looked up through its index by
+        plugin, and returned as a copy.
+        """
         if conf is None:
-            conf = self.conf()
-        plugin_conf = Conf()
-        for section in conf:
-            if re.compile("^" + plugin_name + "(|:.*)$").match(section):
-                plugin_conf[section] = conf[section]
-        return plugin_conf
+            return self._conf_copy(self._plugin_sections(plugin_name))
+        sections_index = Resolver.index_sections(conf)
+        return self._sections_conf(conf, sections_index.get(plugin_name, ()))
+
+    def _conf_merged(self):
+        # Shared by the resolver, see conf for a copy
+        self._load_confs()
+        return self.confs.merged()
+
+    def _conf_base_merged(self):
+        self._load_conf_base()
+        self._load_conf_profile()
+        return self.confs.merged(("base", "profile"))
+
+    def _plugin_sections(self, plugin_name):
+        # Shared view following the merged conf: it is only given to the
+        # plugin owning these sections, which may set types on it
+        self._load_confs()
+        return self.confs.sections(plugin_name)
+
+    def _conf_copy(self, conf):
+        conf_copy = Conf(conf_section_class=conf.conf_section_class)
+        for (section_name, section) in conf.items():
+            conf_copy[section_name] = conf.conf_section_class(section)
+        return conf_copy
+
+    def _sections_conf(self, conf, section_names):
+        return Conf(
+            dict([(section_name, conf[section_name]) for section_name in section_names])
+        )
 
     def plugins(self):
         self._plugins_load()
@@ -128,21 +214,72 @@ class SJConf:
 
     @classmethod
     def restart_all_services(cls, plugin):
-        for service in plugin.services_to_restart():
-            cls.restart_service(service)
+        ServiceExecutor().run(
+            "restart", plugin.services_to_restart(), plugin.services_ordering()
+        )
 
     @classmethod
     def reload_all_services(cls, plugin):
-        for service in plugin.services_to_reload():
-            cls.reload_service(service)
+        ServiceExecutor().run(
+            "reload", plugin.services_to_reload(), plugin.services_ordering()
+        )
 
     @classmethod
     def restart_service(cls, service):
-        os.system("systemctl restart %s" % service)
+        ServiceExecutor().run("restart", (service,))
 
     @classmethod
     def reload_service(cls, service):
-        os.system("systemctl reload %s" % service)
+        ServiceExecutor().run("reload", (service,))
+
+    @property
+    def backup_store(self):
+        """The backup store, only loaded by the commands using it."""
+        if self._backup_store is None:
+            from sjconfparts.backup import BackupStore
+
+            self._backup_store = BackupStore(self.backup_dir, self.backup_compression)
+        return self._backup_store
+
+    @property
+    def backup_retention(self):
+        """The retention policy, as arguments of BackupStore.prune.
+
+        Only parsed by the commands deploying or pruning, so that an invalid
+        value can still be fixed with the other commands.
+        """
+        if self._backup_retention is None:
+            conf = self.confs_internal["sjconf"]["conf"]
+            backup_retention = {}
+            for key in ("backup_keep_last", "backup_keep_daily", "backup_keep_weekly"):
+                if key in conf:
+                    try:
+                        backup_retention[key.replace("backup_", "")] = int(conf[key])
+                    except ValueError:
+                        raise BackupRetentionError(key, conf[key], "a number")
+            if "backup_max_size" in conf:
+                try:
+                    backup_retention["max_size"] = Type.convert(
+                        "str", "size", conf, {}, "backup_max_size"
+                    )["backup_max_size"]
+                except ConversionError:
+                    raise BackupRetentionError(
+                        "backup_max_size",
+                        conf["backup_max_size"],
+                        "a size, e.g. 500M",
+                    )
+            self._backup_retention = backup_retention
+        return self._backup_retention
+
+    def template_engine(self, name):
+        """Returns the template engine named @name."""
+        if not name in self.template_engines:
+            from sjconfparts.template import TemplateEngine
+
+            self.template_engines[name] = TemplateEngine.engine(
+                name, self.template_cache_path
+            )
+        return self.template_engines[name]
 
     def restart_services(self, services_to_restart, reload=False):
         self._plugins_load()
@@ -159,17 +296,28 @@ class SJConf:
         if invalid_plugins:
             raise PluginsNotExistError(*invalid_plugins)
         # services_to_restart are plugins name actually
-        services = set()
+        plugin_services = {}
         for plugin in services_to_restart:
             if reload:
-                services |= set(plugins_hash[plugin].services_to_reload())
-            else:
-                services |= set(plugins_hash[plugin].services_to_restart())
-        for service in services:
-            if reload:
-                self.reload_service(service)
+                plugin_services[plugin] = plugins_hash[plugin].services_to_reload()
             else:
-                self.restart_service(service)
+                plugin_services[plugin] = plugins_hash[plugin].services_to_restart()
+        services = set()
+        ordering = []
+        for plugin in services_to_restart:
+            services |= set(plugin_services[plugin])
+            ordering.extend(plugins_hash[plugin].services_ordering())
+            # The services of a plugin are run after those of its dependencies
+            for dependency_name in self.plugins_graph.dependency_names[plugin]:
+                if dependency_name in plugin_services:
+                    ordering.extend(
+                        [
+                            (dependency_service, service)
+                            for dependency_service in plugin_services[dependency_name]
+                            for service in plugin_services[plugin]
+                        ]
+                    )
+        self.service_executor.run(reload and "reload" or "restart", services, ordering)
 
     def delete_section(self, section):
         self._load_conf_local()
@@ -234,7 +382,7 @@ class SJConf:
                 if regexp.match(key_to_test)
             ]
         )
-        conf_base = self.conf_base()
+        conf_base = self._conf_base_merged()
         if section in conf_base and key in conf_base[section] and key not in new_keys:
             new_keys[key] = ""
         for new_key in list(
@@ -277,7 +425,14 @@ class SJConf:
         if not conf[section]:
             del conf[section]
 
-    def apply_conf_modifications(self, temp=False, **kw):
+    def apply_conf_modifications(self, temp=False, stream=None, **kw):
+        """Applies the modifications given as keyword arguments, then the ones
+        read from @stream, and saves local.conf once.
+
+        @stream is an iterable of lines, each one holding a JSON object such
+        as {"op": "add-to-list", "section": "...", "key": "...", "value": "..."},
+        see BATCH_OPERATIONS for the valid operations.
+        """
         self._load_conf_local()
         conf = self.confs["local"]
         for (key, value,) in list(
@@ -285,13 +440,18 @@ class SJConf:
         ):  # We use “items” since we are modifying the dictionary
             if len(value) == 0:
                 del kw[key]
-        if len(kw) > 0:
+        if len(kw) > 0 or stream is not None:
             self._logger("########## Scheduled modifications ##############")
 
             for (key, values) in kw.items():
                 for value in values:
                     getattr(self, re.sub("s$", "", key))(*value)
 
+            if stream is not None:
+                for (line_number, line) in enumerate(stream, 1):
+                    if line.strip():
+                        self._apply_conf_operation(line_number, line)
+
             self._logger("#################################################\n")
 
         if temp:
@@ -300,16 +460,61 @@ class SJConf:
             output_file = conf.file_path
         conf.save(output_file)
 
-    def deploy_conf(self, services_to_restart=(), services_to_reload=(), backup=True):
+    def deploy_conf(
+        self,
+        services_to_restart=(),
+        services_to_reload=(),
+        backup=True,
+        restart_changed=False,
+        reload_changed=False,
+        jobs=1,
+    ):
+        """Writes the configuration files, and returns the ones that changed.
+
+        Unchanged files are neither backed up nor written. If @restart_changed
+        (resp. @reload_changed) is True, only the services of the plugins
+        whose files changed are restarted (resp. reloaded): all of them if
+        @services_to_restart (resp. @services_to_reload) is empty, otherwise
+        the listed ones.
+
+        If @jobs is greater than 1, the files are rendered, compared and
+        written by that many threads.
+        """
+        if backup:
+            # Invalid values are reported before anything is deployed
+            backup_retention = self.backup_retention
         self._plugins_load()
-        conf_files = self._conf_files(self.plugins_list)
+        conf_files = self._conf_files(self.plugins_list, jobs)
+        # Must be known before the files are written
+        conf_files_changed = [
+            conf_file
+            for (conf_file, changed) in zip(
+                conf_files, self._parallel_map(self._file_changed, conf_files, jobs)
+            )
+            if changed
+        ]
         if backup:
-            files_to_backup = self._files_to_backup(self.plugins_list) + conf_files
+            conf_files_unchanged_path = set(
+                conf_file.path for conf_file in conf_files if not conf_file.changed
+            )
+            files_to_backup = [
+                file_to_backup
+                for file_to_backup in self._files_to_backup(self.plugins_list)
+                if file_to_backup.path not in conf_files_unchanged_path
+            ] + conf_files_changed
             self.backup_files(files_to_backup)
+        if restart_changed:
+            services_to_restart = self._plugins_changed(
+                services_to_restart, conf_files_changed
+            )
+        if reload_changed:
+            services_to_reload = self._plugins_changed(
+                services_to_reload, conf_files_changed
+            )
 
         try:
             # Write all configuration files
-            self._apply_confs(conf_files)
+            self._apply_confs(conf_files, jobs)
 
             # restart services if asked
             if len(services_to_restart) > 0:
@@ -323,22 +528,31 @@ class SJConf:
             if backup:
                 # Something when wrong, restoring backup files
                 self.restore_files(files_to_backup)
-            if len(services_to_restart) > 0:
-                self.restart_services(services_to_restart)
-            if len(services_to_reload) > 0:
-                self.restart_services(services_to_reload, reload=True)
-            # And delete backup folder
+            # Do not hide the original error behind a service failure
+            try:
+                if len(services_to_restart) > 0:
+                    self.restart_services(services_to_restart)
+            except ServiceError as exception:
+                self._logger(str(exception))
+            try:
+                if len(services_to_reload) > 0:
+                    self.restart_services(services_to_reload, reload=True)
+            except ServiceError as exception:
+                self._logger(str(exception))
+            # And delete the backup, nothing was deployed
             if backup:
-                self._delete_backup_dir()
+                self._delete_backup()
             raise
         if backup:
-            # Only archive once everything is OK
-            self._archive_backup()
+            self._logger("Backup : %s" % self.backup_id)
             self._logger("")
-            # Delete backup, everything is cool
-            self._delete_backup_dir()
+            # Only compress once services are restarted
+            self._archive_backup()
+            if backup_retention:
+                self.prune_backups()
         else:
             self._logger("No backup created as requested")
+        return conf_files_changed
 
     def file_install(self, file_type, file_to_install, link=False):
         if self.verbose:
@@ -353,12 +567,29 @@ class SJConf:
             self.files_path[file_type] + "/" + os.path.basename(file_to_install)
         )
         if not link:
+            import shutil
+
             if os.path.isdir(file_to_install):
                 shutil.copytree(file_to_install, file_destination_path)
             else:
                 shutil.copy(file_to_install, file_destination_path)
         else:
             os.symlink(os.path.realpath(file_to_install), file_destination_path)
+        if file_type == "plugin" and self.plugin_manifest:
+            plugin_name = os.path.basename(file_to_install).replace(".py", "")
+            try:
+                self._plugins_info([plugin_name])
+            except Exception as exception:
+                # A plugin which cannot be loaded is not left installed
+                if os.path.islink(file_destination_path) or not os.path.isdir(
+                    file_destination_path
+                ):
+                    os.unlink(file_destination_path)
+                else:
+                    import shutil
+
+                    shutil.rmtree(file_destination_path)
+                raise Plugin.LoadError(plugin_name, exception)
         if self.verbose:
             self._logger("Installed file: %s" % (file_to_install))
 
@@ -370,9 +601,16 @@ class SJConf:
         if not os.path.islink(file_to_uninstall_path) and os.path.isdir(
             file_to_uninstall_path
         ):
+            import shutil
+
             shutil.rmtree(file_to_uninstall_path)
         else:
             os.unlink(file_to_uninstall_path)
+        if file_type == "plugin" and self.plugin_manifest:
+            self.plugin_manifest.delete(
+                os.path.basename(file_to_uninstall_path).replace(".py", "")
+            )
+            self.plugin_manifest.save()
         if self.verbose:
             self._logger("Uninstalled file: %s" % (file_to_uninstall))
 
@@ -436,13 +674,11 @@ class SJConf:
                     ),
                 )
             )
-        plugins = self._plugins_init(plugins_to_list)
-        plugins_hash = {}
-        for plugin in plugins:
-            plugins_hash[plugin.name()] = plugin
+        plugins = self._plugins_info(plugins_to_list)
+        plugins_graph = self._plugins_graph(plugins)
         plugins_list = {}
         for plugin in plugins:
-            plugins_list[plugin.name()] = self._plugin_list(plugin, plugins_hash)
+            plugins_list[plugin.name()] = self._plugin_list(plugin, plugins_graph)
         return plugins_list
 
     def profiles_infos(self, profiles_to_list=None):
@@ -462,38 +698,34 @@ class SJConf:
         return profiles_hash
 
     def backup_files(self, files_to_backup=None):
+        """Stores @files_to_backup and local.conf into a new backup.
+
+        Files are copied into the backup store, and stay in place.
+        """
         self._load_conf_local()
         if files_to_backup is None:
             self._plugins_load()
             files_to_backup = self._files_to_backup(
                 self.plugins_list
             ) + self._conf_files(self.plugins_list)
-        self._logger("Backup folder : %s" % self.backup_dir)
-        os.makedirs(self.backup_dir)
-        os.makedirs(self.backup_dir + "/sjconf/")
-        shutil.copy(self.confs["local"].file_path, self.backup_dir + "/sjconf")
-        # Store all files into a service dedicated folder
-        for file_to_backup in files_to_backup:
-            if not os.path.isfile(file_to_backup.path):
-                continue
-            if not os.path.isdir(self.backup_dir + "/" + file_to_backup.plugin_name):
-                os.makedirs(self.backup_dir + "/" + file_to_backup.plugin_name)
-            file_to_backup.backup_path = (
-                self.backup_dir
-                + "/"
-                + file_to_backup.plugin_name
-                + "/"
-                + os.path.basename(file_to_backup.path)
-            )
-            shutil.move(file_to_backup.path, file_to_backup.backup_path)
-            file_to_backup.backed_up = True
+        local_conf = Plugin.File(self.confs["local"].file_path, None, "sjconf")
+        # Objects are only referenced once the manifest is saved
+        with self.backup_store.lock():
+            self.backup_id = self.backup_store.new_id()
+            self.backup_hashes = []
+            self._logger("Backup %s in %s" % (self.backup_id, self.backup_dir))
+            manifest_files = [
+                self._backup_file(file_to_backup)
+                for file_to_backup in [local_conf] + files_to_backup
+            ]
+            self.backup_store.save_manifest(self.backup_id, manifest_files)
         return files_to_backup
 
     def _logger(self, str):
         if self.logger:
             self.logger(str)
 
-    def _plugin_list(self, plugin_to_list, plugins_hash):
+    def _plugin_list(self, plugin_to_list, plugins_graph):
         plugin_info = {}
         plugin_info["plugin"] = plugin_to_list
         plugin_info["is_enabled"] = (
@@ -508,53 +740,40 @@ class SJConf:
                 dependency.name in self.confs_internal["sjconf"]["conf"]["plugins_list"]
             )
             plugin_info["dependencies"][dependency.name]["plugin"] = (
-                dependency.name in plugins_hash and plugins_hash[dependency.name]
-            ) or None
+                plugins_graph.plugins.get(dependency.name)
+            )
             try:
-                self._plugin_dependency_verify(plugin_to_list, dependency, plugins_hash)
+                plugins_graph.verify(plugin_to_list, dependency)
                 plugin_info["dependencies"][dependency.name]["state"] = True
             except Plugin.Dependency.Error as exception:
                 plugin_info["dependencies"][dependency.name]["state"] = exception
         return plugin_info
 
-    def _plugin_dependency_verify(self, plugin, dependency, plugins_hash):
-        if (
-            not dependency.name in self.confs_internal["sjconf"]["conf"]["plugins_list"]
-            and not dependency.optional
-        ):  # Plugin is not available, find out if it is not installed or not enabled
-            try:
-                self._file_path(
-                    "plugin", dependency.name
-                )  # This will raise an Error if plugin is not installed
-                raise Plugin.Dependency.NotEnabledError(plugin.name(), dependency.name)
-            except FileNotInstalledError:
-                raise Plugin.Dependency.NotInstalledError(
-                    plugin.name(), dependency.name
-                )
-
-        if (
-            dependency.name in self.confs_internal["sjconf"]["conf"]["plugins_list"]
-            and dependency.name in plugins_hash
-        ):
-            dependency.verify(plugins_hash[dependency.name].version())
-
-    def _plugin_dependencies(self, plugin, plugins_hash):
-        plugin_dependencies_hash = {}
-        for dependency in plugin.dependencies():
-            if not dependency.name in plugins_hash and dependency.optional:
-                continue
-            self._plugin_dependency_verify(plugin, dependency, plugins_hash)
-            plugin_dependencies_hash[dependency.name] = plugins_hash[dependency.name]
-        return plugin_dependencies_hash
+    def _plugins_graph(self, plugins):
+        # Dependency graph of plugins, the installed plugins being listed once
+        plugins_installed = set()
+        try:
+            file_names = os.listdir(self.files_path["plugin"])
+        except OSError:
+            file_names = []
+        for file_name in file_names:
+            if file_name.endswith(".py"):
+                plugins_installed.add(file_name[: -len(".py")])
+            elif os.path.isdir(self.files_path["plugin"] + "/" + file_name):
+                plugins_installed.add(file_name)
+        return PluginGraph(
+            plugins,
+            self.confs_internal["sjconf"]["conf"]["plugins_list"],
+            plugins_installed,
+        )
 
     def _plugins_dependencies(self, plugins):
-        plugins_hash = {}
-        for plugin in plugins:
-            plugins_hash[plugin.name()] = plugin
+        plugins_graph = self._plugins_graph(plugins)
         for plugin in plugins:
-            plugin_dependencies_hash = self._plugin_dependencies(plugin, plugins_hash)
+            plugin_dependencies_hash = plugins_graph.dependencies(plugin)
             if len(plugin_dependencies_hash) > 0:
                 plugin.set_plugins(plugin_dependencies_hash)
+        return plugins_graph
 
     def _plugins_init(self, plugins_list=None):
         if plugins_list is None:
@@ -563,6 +782,8 @@ class SJConf:
         # FIXME: Most of the code below can and should be reused for all other
         # projects that load python plugins.
 
+        import imp
+
         # fake 'sjconf.plugins' package in which we will shove our plugins
         if "sjconf.plugins" not in sys.modules:
             sys.modules["sjconf.plugins"] = imp.new_module("sjconf.plugins")
@@ -577,13 +798,61 @@ class SJConf:
                 *imp.find_module(plugin, [self.files_path["plugin"]])
             )
 
-            plugins.append(plugin_module.Plugin(plugin, self, self.plugin_conf(plugin)))
+            plugins.append(
+                plugin_module.Plugin(plugin, self, self._plugin_sections(plugin))
+            )
         return plugins
 
+    def _plugin_init(self, plugin_name):
+        return self._plugins_init([plugin_name])[0]
+
+    def _plugins_info(self, plugin_names):
+        # PluginInfo of each plugin, from the plugin manifest when the plugin
+        # files are unchanged, else from the imported plugin
+        plugins_info = {}
+        plugins_stat_key = {}
+        for plugin_name in plugin_names:
+            plugins_stat_key[plugin_name] = PluginManifest.stat_key(
+                self._file_path("plugin", plugin_name)
+            )
+            if self.plugin_manifest:
+                metadata = self.plugin_manifest.get(
+                    plugin_name, plugins_stat_key[plugin_name]
+                )
+                if metadata is not None:
+                    plugins_info[plugin_name] = PluginInfo(metadata, self._plugin_init)
+        plugin_names_outdated = [
+            plugin_name
+            for plugin_name in plugin_names
+            if plugin_name not in plugins_info
+        ]
+        if plugin_names_outdated:
+            for plugin in self._plugins_init(plugin_names_outdated):
+                plugins_info[plugin.name()] = PluginInfo.from_plugin(plugin)
+                if self.plugin_manifest:
+                    self.plugin_manifest.set(
+                        plugin.name(),
+                        plugins_stat_key[plugin.name()],
+                        plugins_info[plugin.name()].metadata,
+                    )
+            if self.plugin_manifest:
+                self.plugin_manifest.save()
+        return [plugins_info[plugin_name] for plugin_name in plugin_names]
+
     def _plugins_load(self):
         if self.plugins_list is None:
-            self.plugins_list = self._plugins_init()
-            self._plugins_dependencies(self.plugins_list)
+            plugins_list = self._plugins_init()
+            self.plugins_graph = self._plugins_dependencies(plugins_list)
+            # Plugins are rendered and restarted after their dependencies
+            plugins_hash = dict([(plugin.name(), plugin) for plugin in plugins_list])
+            self.plugins_list = [
+                plugins_hash[plugin_name] for plugin_name in self.plugins_graph.order()
+            ]
+            for plugins_cycle in self.plugins_graph.cycles:
+                self._logger(
+                    "Cyclic dependencies between plugins %s"
+                    % (", ".join(plugins_cycle))
+                )
 
     def _files_to_backup(self, plugins):
         return reduce(
@@ -592,62 +861,183 @@ class SJConf:
             [],
         )
 
-    def _archive_backup(self):
-        # Once configuration is saved, we can archive backup into a tgz
-        path = "%s/sjconf_backup_%s.tgz" % (
-            os.path.dirname(self.backup_dir),
-            os.path.basename(self.backup_dir),
+    def _backup_file(self, file_to_backup):
+        # Returns the manifest entry of file_to_backup
+        manifest_file = {
+            "path": file_to_backup.path,
+            "plugin": file_to_backup.plugin_name,
+            "hash": None,
+            "mode": None,
+            "uid": None,
+            "gid": None,
+            "size": 0,
+        }
+        if not os.path.isfile(file_to_backup.path):
+            return manifest_file
+        stat = os.stat(file_to_backup.path)
+        file_to_backup.backup_mode = stat.st_mode & 0o7777
+        file_to_backup.backup_owner = (stat.st_uid, stat.st_gid)
+        # Generated files are only ever replaced, by _apply_confs, and can be
+        # hard linked
+        file_to_backup.backup_hash = self.backup_store.store(
+            file_to_backup.path, link=file_to_backup.content is not None
+        )
+        file_to_backup.backup_path = self.backup_store.object_path(
+            file_to_backup.backup_hash
         )
-        self._logger("Backup file : %s" % path)
-        with tarfile.open(path, "w:gz") as tar:
-            tar.add(self.backup_dir)
-
-    def _delete_backup_dir(self, dir=None):
-        # Once backup has been archived, delete it
-        if dir is None:
-            dir = self.backup_dir
-            self._logger("Deleting folder %s" % dir)
-
-        for entry in os.listdir(dir):
-            path = dir + "/" + entry
-            if os.path.isdir(path):
-                self._delete_backup_dir(path)
-            elif os.path.isfile(path):
-                os.unlink(path)
-        os.rmdir(dir)
+        file_to_backup.backed_up = True
+        self.backup_hashes.append(file_to_backup.backup_hash)
+        manifest_file["hash"] = file_to_backup.backup_hash
+        manifest_file["mode"] = file_to_backup.backup_mode
+        (manifest_file["uid"], manifest_file["gid"]) = file_to_backup.backup_owner
+        manifest_file["size"] = stat.st_size
+        return manifest_file
+
+    def prune_backups(self):
+        """Deletes the backups not kept by the retention policy of sjconf.conf.
+
+        Returns the identifiers of the deleted backups.
+        """
+        backup_ids_pruned = self.backup_store.prune(**self.backup_retention)
+        for backup_id in backup_ids_pruned:
+            self._logger("Deleted backup %s" % (backup_id))
+        return backup_ids_pruned
+
+    def rollback(self, backup_id=None, reload=False):
+        """Restores the files as they were before the deployment of backup
+        @backup_id, the latest one by default.
+
+        A backup holds local.conf as deployed, so local.conf is restored
+        from the backup preceding @backup_id, if any. The current state of
+        the restored files is first saved into a new backup, then the
+        services of their plugins are restarted, or reloaded if @reload is
+        True. As after a deployment, the new backup is then compressed and
+        the retention policy enforced. Returns the manifest entries of the
+        restored files.
+        """
+        # Invalid values are reported before anything is restored
+        backup_retention = self.backup_retention
+        backups = self.backup_store.backups()
+        if backup_id is None:
+            backups = [backup for backup in backups if not "archive" in backup]
+            if not backups:
+                raise BackupNotFoundError()
+            backup_id = backups[-1]["id"]
+        backup_ids = [backup["id"] for backup in backups]
+        if not backup_id in backup_ids:
+            raise BackupNotFoundError(backup_id)
+        backup_index = backup_ids.index(backup_id)
+        if "archive" in backups[backup_index]:
+            raise BackupArchiveError(
+                self.backup_dir + "/" + backups[backup_index]["archive"]
+            )
+        manifest_files = [
+            manifest_file
+            for manifest_file in self.backup_store.manifest(backup_id)["files"]
+            if manifest_file["plugin"] != "sjconf"
+        ]
+        if backup_index > 0 and not "archive" in backups[backup_index - 1]:
+            manifest_files += [
+                manifest_file
+                for manifest_file in self.backup_store.manifest(
+                    backup_ids[backup_index - 1]
+                )["files"]
+                if manifest_file["plugin"] == "sjconf"
+            ]
+        files_to_restore = [
+            manifest_file
+            for manifest_file in manifest_files
+            if self._backup_file_changed(manifest_file)
+        ]
+        if not files_to_restore:
+            self._logger("Files of backup %s unchanged" % (backup_id))
+            return files_to_restore
+        self.backup_files(
+            [
+                Plugin.File(manifest_file["path"], None, manifest_file["plugin"])
+                for manifest_file in files_to_restore
+                if manifest_file["plugin"] != "sjconf"
+            ]
+        )
+        self._logger("Restoring files from backup %s" % (backup_id))
+        try:
+            self.backup_store.restore_files(files_to_restore)
+        except (IOError, OSError, BackupCorruptedError) as exception:
+            self._delete_backup()
+            raise RestoreError(exception, self.backup_dir)
+        self._load_confs(force=True)
+        self._plugins_load()
+        plugin_names = set([plugin.name() for plugin in self.plugins_list])
+        self.restart_services(
+            sorted(
+                set([manifest_file["plugin"] for manifest_file in files_to_restore])
+                & plugin_names
+            ),
+            reload=reload,
+        )
+        self._logger("Backup : %s" % self.backup_id)
+        self._archive_backup()
+        if backup_retention:
+            self.prune_backups()
+        return files_to_restore
+
+    def _backup_file_changed(self, manifest_file):
+        if not os.path.isfile(manifest_file["path"]):
+            return manifest_file["hash"] is not None
+        if manifest_file["hash"] is None:
+            return True
+        stat = os.stat(manifest_file["path"])
+        owner = self.backup_store.manifest_owner(manifest_file)
+        return (
+            self.backup_store.hash_file(manifest_file["path"]) != manifest_file["hash"]
+            or manifest_file["mode"] != stat.st_mode & 0o7777
+            or (owner is not None and owner != (stat.st_uid, stat.st_gid))
+        )
+
+    def _archive_backup(self):
+        if self.backup_archive == "detached":
+            self.backup_store.archive_detached()
+        else:
+            self.backup_store.archive(self.backup_hashes)
+
+    def _delete_backup(self):
+        self._logger("Deleting backup %s" % self.backup_id)
+        self.backup_store.delete(self.backup_id)
 
     def restore_files(self, backed_up_files):
         # Something went wrong
         self._logger("Restoring files from %s" % self.backup_dir)
 
-        # Unlink all conf files just created
-        for backed_up_file in backed_up_files:
-            if backed_up_file.written and os.path.isfile(backed_up_file.path):
-                os.unlink(backed_up_file.path)
-
-        # Restore backup files
         for backed_up_file in backed_up_files:
-            if backed_up_file.backed_up:
-                try:
-                    shutil.move(backed_up_file.backup_path, backed_up_file.path)
-                except shutil.Error as exception:
-                    raise RestoreError(exception, self.backup_dir)
+            try:
+                if backed_up_file.backed_up:
+                    # Atomically replaces the file possibly just created
+                    self.backup_store.restore(
+                        backed_up_file.backup_hash,
+                        backed_up_file.backup_mode,
+                        backed_up_file.path,
+                        backed_up_file.backup_owner,
+                    )
+                elif backed_up_file.written and os.path.isfile(backed_up_file.path):
+                    # File created by the deployment
+                    os.unlink(backed_up_file.path)
+            except (IOError, OSError, BackupCorruptedError) as exception:
+                raise RestoreError(exception, self.backup_dir)
 
     def _load_confs(self, force=False):
         self._load_conf_local(force)
         self._load_conf_profile(force)
         self._load_conf_base(force)
+        if self.parse_cache:
+            self.parse_cache.drop_deleted()
 
     def _load_conf_local(self, force=False):
-        if not self.confs:
-            self.confs = {}
         if not "local" in self.confs or force:
             self.confs["local"] = self._load_conf_part("local", "raw")
             self.confs["local"].set_type("sjconf", "profiles", "sequence")
+            self._parse_cache_save()
 
     def _load_conf_profile(self, force=False):
-        if not self.confs:
-            self.confs = {}
         self._load_conf_local(force)
         if (not "profile" in self.confs or force) and "sjconf" in self.confs["local"]:
             self.confs["profile"] = self._load_conf(
@@ -662,21 +1052,30 @@ class SJConf:
                 ],
                 self.confs["local"],
             )
+            self._parse_cache_save()
 
     def _load_conf_base(self, force=False):
-        if not self.confs:
-            self.confs = {}
         if not "base" in self.confs or force:
             self.confs["base"] = self._load_conf_part("base", "magic")
+            self._parse_cache_save()
+
+    def _parse_cache_save(self):
+        # Once per layer, so that loading a single layer also fills the cache
+        if self.parse_cache:
+            self.parse_cache.save()
 
     def _load_conf(self, conf_files, conf_local):
         conf = Conf()
         conf_level_parts = []
+        # (section, key) pairs set by local.conf or by an already loaded,
+        # higher, level: their conflicts in lower levels are overridden
+        keys_overriding = self._conf_keys(conf_local)
         conf_files.reverse()
         for conf_level_files in conf_files:
             conf_level_parts.append(
-                self._load_conf_level(conf_level_files, conf_level_parts + [conf_local])
+                self._load_conf_level(conf_level_files, keys_overriding)
             )
+            keys_overriding |= self._conf_keys(conf_level_parts[-1])
         conf_level_parts.reverse()
         for conf_level_part in conf_level_parts:
             conf.update(conf_level_part)
@@ -685,12 +1084,16 @@ class SJConf:
         conf_files.reverse()
         return conf
 
-    def _load_conf_level(self, conf_level_files, conf_level_parts):
+    def _load_conf_level(self, conf_level_files, keys_overriding):
         conf_level = Conf()
         conf_parts = []
+        # Parts of the level defining each (section, key) pair, with values
+        conf_level_index = {}
         for (conf_file, conf_type) in conf_level_files:
             conf_part = self._load_conf_part(conf_file, conf_type)
-            self._verify_conflict(conf_part, conf_parts, conf_level_parts)
+            self._verify_conflict(
+                conf_part, len(conf_parts), conf_level_index, keys_overriding
+            )
             conf_parts.append(conf_part)
         for conf_part in conf_parts:
             conf_level.update(conf_part)
@@ -698,38 +1101,78 @@ class SJConf:
             conf_level.file_path = conf_parts[0].file_path
         return conf_level
 
-    def _load_conf_part(self, conf_file, conf_type):
+    def conf_file_path(self, conf_file):
+        """Path of the configuration file @conf_file, e.g. "local"."""
         conf_file_path = os.path.realpath(self.base_dir + "/" + conf_file)
         if not os.path.exists(conf_file_path):
             conf_file_path += ".conf"
-        return Conf(file_path=conf_file_path, parser_type=conf_type)
+        return conf_file_path
 
-    def _overriden_in_level(self, conf_level_parts, section, key):
-        for other_conf_level_part in conf_level_parts:
-            if (
-                section in other_conf_level_part
-                and key in other_conf_level_part[section]
-            ):
-                return True
-        return False
-
-    def _verify_conflict(self, conf_part, conf_parts, conf_level_parts):
-        for other_conf_part in conf_parts:
-            conflicting_values = conf_part.update_verify_conflict(other_conf_part)
-            if len(conflicting_values) != 0:
-                for conflicting_value in conflicting_values:
-                    section = conflicting_value[0]
-                    key = conflicting_value[1]
-                    if not self._overriden_in_level(conf_level_parts, section, key):
-                        conf_part_name = os.path.basename(conf_part.file_path).replace(
-                            ".conf", ""
-                        )
-                        other_conf_part_name = os.path.basename(
-                            other_conf_part.file_path
-                        ).replace(".conf", "")
-                        raise Conf.ProfileConflictError(
-                            conf_part_name, other_conf_part_name, section, key
-                        )
+    def _load_conf_part(self, conf_file, conf_type):
+        return Conf(
+            file_path=self.conf_file_path(conf_file),
+            parser_type=conf_type,
+            cache=self.parse_cache,
+        )
+
+    def _conf_keys(self, conf):
+        return set(
+            [
+                (section_name, key)
+                for (section_name, section) in conf.dict.items()
+                for key in section.dict
+            ]
+        )
+
+    def _verify_conflict(
+        self, conf_part, conf_part_index, conf_level_index, keys_overriding
+    ):
+        # Verifies conf_part, the conf_part_index-th part of its level,
+        # against the previous parts indexed in conf_level_index, then adds
+        # it to the index. Reports the conflict with the first part, on the
+        # first key of conf_part.
+        conflicts = []
+        position = 0
+        for (section_name, section) in conf_part.dict.items():
+            for (key, value) in section.dict.items():
+                if (section_name, key) in conf_level_index and not (
+                    (section_name, key) in keys_overriding
+                ):
+                    for (other_conf_part_index, other_conf_part, other_value) in (
+                        conf_level_index[(section_name, key)]
+                    ):
+                        if other_value != value:
+                            conflicts.append(
+                                (
+                                    other_conf_part_index,
+                                    position,
+                                    other_conf_part,
+                                    section_name,
+                                    key,
+                                )
+                            )
+                            break
+                position += 1
+        if conflicts:
+            (
+                other_conf_part_index,
+                position,
+                other_conf_part,
+                section,
+                key,
+            ) = min(conflicts, key=lambda conflict: conflict[:2])
+            conf_part_name = os.path.basename(conf_part.file_path).replace(".conf", "")
+            other_conf_part_name = os.path.basename(other_conf_part.file_path).replace(
+                ".conf", ""
+            )
+            raise Conf.ProfileConflictError(
+                conf_part_name, other_conf_part_name, section, key
+            )
+        for (section_name, section) in conf_part.dict.items():
+            for (key, value) in section.dict.items():
+                conf_level_index.setdefault((section_name, key), []).append(
+                    (conf_part_index, conf_part, value)
+                )
 
     def _profile_level(self, profile):
         self._load_conf_local()
@@ -748,29 +1191,80 @@ class SJConf:
                 return int(match_results.group(1))
         return None
 
-    def _apply_confs(self, conf_files=None):
-        # Open and write all configuration files
+    def _apply_confs(self, conf_files=None, jobs=1):
+        # Open and write all configuration files, skipping the unchanged ones
         if conf_files is None:
             self._plugins_load()
-            conf_files = self._conf_files(self.plugins_list)
+            conf_files = self._conf_files(self.plugins_list, jobs)
+        conf_files_changed = []
         for conf_file in conf_files:
+            if not self._file_changed(conf_file):
+                self._logger(
+                    "Configuration file %s unchanged (%s)"
+                    % (conf_file.path, conf_file.plugin_name)
+                )
+                continue
             self._logger(
                 "Writing configuration file %s (%s)"
                 % (conf_file.path, conf_file.plugin_name)
             )
-            # checking if the dirname exists
-            folder = os.path.dirname(conf_file.path)
-            if not os.path.isdir(folder):
-                os.makedirs(folder)
-            with open(conf_file.path + ".sjconf", "w") as fi:
-                fi.write(conf_file.content)
-            os.rename(conf_file.path + ".sjconf", conf_file.path)
-            conf_file.written = True
+            conf_files_changed.append(conf_file)
+        # Every written file is flagged, even if another one failed
+        self._parallel_map(self._write_conf_file, conf_files_changed, jobs)
         self._logger("")
+        return conf_files_changed
+
+    def _write_conf_file(self, conf_file):
+        # checking if the dirname exists
+        folder = os.path.dirname(conf_file.path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder, exist_ok=True)
+        with open(conf_file.path + ".sjconf", "w") as fi:
+            fi.write(conf_file.content)
+        os.rename(conf_file.path + ".sjconf", conf_file.path)
+        conf_file.written = True
+
+    def _parallel_map(self, function, items, jobs):
+        # Returns the results in the order of items. Once all of them are
+        # done, raises the first exception, if any
+        if jobs <= 1 or len(items) <= 1:
+            return list(map(function, items))
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(function, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _plugins_changed(self, plugin_names, conf_files_changed):
+        # Unknown plugins are kept, so that restart_services reports them
+        plugin_names_changed = set(
+            conf_file.plugin_name for conf_file in conf_files_changed
+        )
+        plugins_hash = dict([(plugin.name(), plugin) for plugin in self.plugins_list])
+        if not plugin_names or "all" in plugin_names:
+            plugin_names = list(plugins_hash.keys())
+        return [
+            plugin_name
+            for plugin_name in plugin_names
+            if plugin_name in plugin_names_changed or plugin_name not in plugins_hash
+        ]
 
-    def _conf_files(self, plugins):
+    def _file_changed(self, conf_file):
+        if conf_file.changed is None:
+            try:
+                # No newline translation, to compare the exact content
+                with open(conf_file.path, newline="") as fi:
+                    conf_file.changed = fi.read() != conf_file.content
+            except (IOError, OSError, UnicodeDecodeError):
+                conf_file.changed = True
+        return conf_file.changed
+
+    def _conf_files(self, plugins, jobs=1):
+        # Plugins render their files independently from each other
         return reduce(
-            lambda conf_files, plugin: conf_files + plugin.conf_files(), plugins, []
+            lambda conf_files, plugin_conf_files: conf_files + plugin_conf_files,
+            self._parallel_map(lambda plugin: plugin.conf_files(), plugins, jobs),
+            [],
         )
 
     def _file_verify_conf(self, conf_file_to_verify):
@@ -815,17 +1309,61 @@ class SJConf:
         ):  # Plugin file currently used
             self.plugin_disable(file)
 
+    def _apply_conf_operation(self, line_number, line):
+        try:
+            operation = json.loads(line)
+        except ValueError as exception:
+            raise BatchError(line_number, "invalid JSON: %s" % (exception))
+        if not isinstance(operation, dict):
+            raise BatchError(line_number, "a JSON object is expected")
+        if operation.get("op") not in self.BATCH_OPERATIONS:
+            raise BatchError(
+                line_number, "unknown operation %s" % (json.dumps(operation.get("op")))
+            )
+        (method, arg_names) = self.BATCH_OPERATIONS[operation["op"]]
+        args = []
+        for arg_name in arg_names:
+            if not isinstance(operation.get(arg_name), str):
+                raise BatchError(
+                    line_number,
+                    'operation "%s" expects a string "%s"'
+                    % (operation["op"], arg_name),
+                )
+            args.append(operation[arg_name])
+        try:
+            getattr(self, method)(*args)
+        except Error as exception:
+            raise BatchError(line_number, str(exception))
+        except KeyError as exception:
+            raise BatchError(
+                line_number,
+                'operation "%s" failed: no section or key %s'
+                % (operation["op"], exception),
+            )
+        except ValueError as exception:
+            raise BatchError(
+                line_number,
+                'operation "%s" failed: %s' % (operation["op"], exception),
+            )
+
+    def _typed_section(self, conf, section, key, type):
+        # Work on a copy: conf may be a view shared by the resolver
+        typed_section = conf.conf_section_class(dict(conf[section]))
+        typed_section.set_type(key, type)
+        return typed_section
+
     def _generic_list_add(self, section, key, type, value):
         key_typed = key + "_" + type
         try:
-            conf = self.conf_local()
-            conf.set_type(section, key, type)
-            value_old = conf[section][key_typed]
+            self._load_conf_local()
+            conf_section = self._typed_section(self.confs["local"], section, key, type)
+            value_old = conf_section[key_typed]
         except KeyError:
             try:
-                conf = self.conf_base()
-                conf.set_type(section, key, type)
-                value_old = conf[section][key_typed]
+                conf_section = self._typed_section(
+                    self._conf_base_merged(), section, key, type
+                )
+                value_old = conf_section[key_typed]
                 self._logger(
                     'The key "%s" in section "%s" does not exist in local configuration, but exist in base or profile configuration, the new value will be appended to "%s".'
                     % (key, section, repr(value_old))
@@ -839,13 +1377,13 @@ class SJConf:
     def _generic_list_remove(self, section, key, type, value):
         key_typed = key + "_" + type
         try:
-            conf = self.conf_local()
-            conf.set_type(section, key, type)
-            conf[section][key_typed]
+            self._load_conf_local()
+            self._typed_section(self.confs["local"], section, key, type)[key_typed]
         except KeyError:
-            conf = self.conf_base()
-            conf.set_type(section, key, type)
-            value_base = conf[section][key_typed]
+            conf_section = self._typed_section(
+                self._conf_base_merged(), section, key, type
+            )
+            value_base = conf_section[key_typed]
             self._logger(
                 'The key "%s" in section "%s" does not exist in local configuration, but exist in base or profile configuration, the new value will be removed from "%s".'
                 % (key, section, repr(value_base))
@@ -853,25 +1391,27 @@ class SJConf:
         self._generic_list_modify(section, key, type, value, "remove")
 
     def _generic_list_modify(self, section, key, type, value, method):
-        conf = self.conf()
+        conf = self._conf_merged()
         key_typed = key + "_" + type
-        if section not in conf:
-            conf[section] = conf.conf_section_class()
-        conf.set_type(section, key, type)
+        if section in conf:
+            conf_section = self._typed_section(conf, section, key, type)
+        else:
+            conf_section = conf.conf_section_class()
+            conf_section.set_type(key, type)
         try:
-            conf[section][key_typed]
+            conf_section[key_typed]
         except KeyError:
-            conf[section][key_typed] = []
-        old_keys = dict(conf[section])
-        getattr(conf[section][key_typed], method)(value)
+            conf_section[key_typed] = []
+        old_keys = dict(conf_section)
+        getattr(conf_section[key_typed], method)(value)
         if section not in self.confs["local"]:
             self.confs["local"][section] = conf.conf_section_class()
-        for new_key, new_value in conf[section].items():
+        for new_key, new_value in conf_section.items():
             if new_value != old_keys.get(new_key):
                 self.confs["local"][section][new_key] = new_value
-        conf_base = self.conf_base().get(section)
+        conf_base = self._conf_base_merged().get(section)
         for old_key in old_keys:
-            if old_key not in conf[section]:
+            if old_key not in conf_section:
                 if conf_base and old_key in conf_base:
                     self.confs["local"][section][old_key] = ""
                 else:
@@ -0,0 +1,560 @@
+import os, re, sys, json, time, shutil, hashlib, subprocess, fcntl, contextlib
+
+from sjconfparts.exceptions import *
+
+
+class BackupStore:
+    """Content-addressed store of backed up files.
+
+    The body of each file is stored once, under objects/, named after the
+    SHA-256 hash of its content. Each backup is a manifest under manifests/,
+    listing the path, plugin, mode, owner and hash of every backed up file
+    (the hash is None for files that did not exist).
+
+    Objects are first stored uncompressed, then compressed by archive(),
+    according to @compression: "none", "gz", "xz" or "zstd", optionally
+    followed by a colon and the compression level (e.g. "gz:6").
+
+    The index file lists the backups with their time and the hashes and
+    sizes of their objects, so that backups are listed and pruned without
+    reading their manifests. It also lists the tarballs written by former
+    versions of sjconf.
+    """
+
+    # Object file name suffix of each compression
+    SUFFIXES = {"none": "", "gz": ".gz", "xz": ".xz", "zstd": ".zst"}
+
+    # ioctl cloning a file on copy-on-write filesystems (linux/fs.h)
+    FICLONE = 0x40049409
+
+    INDEX_VERSION = 1
+
+    LEGACY_ARCHIVE_REGEXP = re.compile(r"^sjconf_backup_(.*)\.tgz$")
+
+    def __init__(self, path, compression="none"):
+        self.path = path
+        (self.compression, self.level) = self.parse_compression(compression)
+        self.index = None
+        # Open lock file while the lock is held, see lock
+        self.lock_file = None
+
+    @classmethod
+    def parse_compression(cls, compression):
+        if ":" in compression:
+            (compression, level) = compression.split(":", 1)
+            try:
+                level = int(level)
+            except ValueError:
+                raise BackupCompressionError(compression + ":" + level)
+        else:
+            level = None
+        if compression not in cls.SUFFIXES:
+            raise BackupCompressionError(compression)
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise BackupCompressionError(compression, "module zstandard missing")
+        return (compression, level)
+
+    def new_id(self):
+        """Returns an unused backup identifier, based on the current time."""
+        backup_id = time.strftime("%F-%R:%S", time.localtime())
+        suffix = 1
+        backup_id_unique = backup_id
+        while os.path.exists(self.manifest_path(backup_id_unique)):
+            suffix += 1
+            backup_id_unique = "%s.%d" % (backup_id, suffix)
+        return backup_id_unique
+
+    def object_path(self, hash, compression="none"):
+        return "%s/objects/%s/%s%s" % (
+            self.path,
+            hash[:2],
+            hash,
+            self.SUFFIXES[compression],
+        )
+
+    def manifest_path(self, backup_id):
+        return "%s/manifests/%s.json" % (self.path, backup_id)
+
+    def has_object(self, hash):
+        return any(
+            os.path.exists(self.object_path(hash, compression))
+            for compression in self.SUFFIXES
+        )
+
+    def store(self, file_path, link=False):
+        """Stores the content of @file_path, and returns its hash.
+
+        If @link is True, the object is a hard link to @file_path when
+        possible: the caller guarantees that @file_path is never modified in
+        place, but only replaced. Otherwise, the object is a reflink, or
+        else a copy, of @file_path.
+        """
+        hash = self.hash_file(file_path)
+        if not self.has_object(hash):
+            object_path = self.object_path(hash)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            temp_path = "%s.%d" % (object_path, os.getpid())
+            self._clone(file_path, temp_path, link)
+            os.rename(temp_path, object_path)
+        return hash
+
+    def archive(self, hashes=None):
+        """Compresses the uncompressed objects @hashes (all if None).
+
+        Only the replacement of each object takes the lock, so that backups
+        are not delayed by the compression.
+        """
+        if self.compression == "none":
+            return
+        if hashes is None:
+            hashes = [
+                name
+                for dir_name in self._list_dir(self.path + "/objects")
+                for name in self._list_dir(self.path + "/objects/" + dir_name)
+                if len(name) == 64
+            ]
+        for hash in set(hashes):
+            object_path = self.object_path(hash)
+            object_path_compressed = self.object_path(hash, self.compression)
+            temp_path = "%s.%d" % (object_path_compressed, os.getpid())
+            try:
+                with open(object_path, "rb") as fi:
+                    with self._open_compressed(temp_path, "wb") as fo:
+                        shutil.copyfileobj(fi, fo)
+            except FileNotFoundError:
+                # Already compressed
+                continue
+            # Archivers run outside of the lock, the object may have been
+            # collected, or compressed by another archiver, meanwhile
+            with self.lock():
+                if os.path.exists(object_path):
+                    os.rename(temp_path, object_path_compressed)
+                    os.unlink(object_path)
+                else:
+                    os.unlink(temp_path)
+
+    def archive_detached(self):
+        """Runs archive() for all objects in a detached process."""
+        if self.compression == "none":
+            return
+        compression = self.compression
+        if self.level is not None:
+            compression += ":%d" % (self.level)
+        with open(os.devnull, "r+") as devnull:
+            subprocess.Popen(
+                [sys.executable, "-m", "sjconfparts.backup", self.path, compression],
+                stdin=devnull,
+                stdout=devnull,
+                stderr=devnull,
+                start_new_session=True,
+            )
+
+    def restore(self, hash, mode, file_path, owner=None):
+        """Atomically replaces @file_path by the stored object @hash.
+
+        The file gets @mode, and @owner, a (uid, gid) tuple, if not None.
+        """
+        os.rename(self._restore_temp(hash, mode, file_path, owner), file_path)
+
+    def restore_files(self, files):
+        """Restores @files, manifest entries, to their backed up state.
+
+        Every object is first written next to its file and verified, and the
+        files are only replaced once all of them are ready. Files without a
+        hash did not exist when backed up, and are deleted.
+        """
+        temp_paths = []
+        try:
+            for file in files:
+                if file["hash"] is not None:
+                    temp_paths.append(
+                        self._restore_temp(
+                            file["hash"],
+                            file["mode"],
+                            file["path"],
+                            self.manifest_owner(file),
+                        )
+                    )
+        except:
+            for temp_path in temp_paths:
+                os.unlink(temp_path)
+            raise
+        for file in files:
+            if file["hash"] is not None:
+                os.rename(file["path"] + ".sjconf", file["path"])
+            elif os.path.lexists(file["path"]):
+                os.unlink(file["path"])
+
+    @classmethod
+    def manifest_owner(cls, file):
+        """Returns the (uid, gid) of manifest entry @file, None if unknown."""
+        if file.get("uid") is None or file.get("gid") is None:
+            # Manifests of former versions do not record the owner
+            return None
+        return (file["uid"], file["gid"])
+
+    @classmethod
+    def hash_file(cls, file_path):
+        """Returns the hash of the content of @file_path."""
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as fi:
+            for chunk in iter(lambda: fi.read(65536), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def save_manifest(self, backup_id, files):
+        """Writes the manifest of backup @backup_id.
+
+        @files is a list of dictionaries with the "path", "plugin", "mode",
+        "uid", "gid" and "hash" keys.
+        """
+        manifest = {"id": backup_id, "time": time.time(), "files": files}
+        manifest_path = self.manifest_path(backup_id)
+        with self.lock():
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            with open(manifest_path + ".tmp", "w") as fi:
+                json.dump(manifest, fi, indent=1)
+            os.rename(manifest_path + ".tmp", manifest_path)
+            self._index_reload()[backup_id] = self._index_entry(manifest)
+            self._index_save()
+
+    def delete(self, backup_id):
+        """Deletes backup @backup_id.
+
+        Objects are shared between backups, and are left in place.
+        """
+        with self.lock():
+            self._index_reload()
+            self._delete(backup_id)
+            self._index_save()
+
+    def backups(self):
+        """Returns the index entries of the backups, from the oldest one.
+
+        Each entry holds the "id" and "time" of the backup, its number of
+        "files", and the "hashes" of its objects with their sizes. Tarballs
+        of former versions have an "archive" file name and its "size"
+        instead of a number of files.
+        """
+        return sorted(
+            self._index().values(), key=lambda backup: (backup["time"], backup["id"])
+        )
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Serializes the modifications of the store between processes.
+
+        Excludes pruning while backups are being created. The lock may be
+        taken again while held.
+        """
+        if self.lock_file is not None:
+            yield
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.path + "/lock", "w") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            self.lock_file = lock_file
+            try:
+                yield
+            finally:
+                self.lock_file = None
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def prune(self, keep_last=None, keep_daily=None, keep_weekly=None, max_size=None):
+        """Deletes the backups not kept by the retention policy, and the
+        objects no longer used, and returns the identifiers of the deleted
+        backups.
+
+        See select_pruned for the policy.
+        """
+        with self.lock():
+            self._index_reload()
+            backups_pruned = self.select_pruned(
+                self.backups(), keep_last, keep_daily, keep_weekly, max_size
+            )
+            for backup in backups_pruned:
+                self._delete(backup["id"])
+            if backups_pruned:
+                self._index_save()
+                self._collect_garbage()
+        return [backup["id"] for backup in backups_pruned]
+
+    @classmethod
+    def select_pruned(
+        cls, backups, keep_last=None, keep_daily=None, keep_weekly=None, max_size=None
+    ):
+        """Returns the @backups, sorted from the oldest one, to delete.
+
+        Kept backups are the @keep_last newest ones, plus the newest backup
+        of each of the @keep_daily newest days, and of each of the
+        @keep_weekly newest weeks. All backups are kept by these rules if
+        none of them is given. Then, from the newest one, the kept backups
+        which would bring the total size of the kept backups over @max_size
+        are deleted, the newest backup being always kept.
+        """
+        backups_newest = list(reversed(backups))
+        if keep_last is None and keep_daily is None and keep_weekly is None:
+            backup_ids_kept = set(backup["id"] for backup in backups)
+        else:
+            backup_ids_kept = set(
+                backup["id"] for backup in backups_newest[: keep_last or 0]
+            )
+        for (keep_periods, period_format) in (
+            (keep_daily, "%Y-%m-%d"),
+            (keep_weekly, "%G-%V"),
+        ):
+            periods = set()
+            for backup in backups_newest:
+                if len(periods) >= (keep_periods or 0):
+                    break
+                period = time.strftime(period_format, time.localtime(backup["time"]))
+                if period not in periods:
+                    periods.add(period)
+                    backup_ids_kept.add(backup["id"])
+        if max_size is not None:
+            size = 0
+            hashes = set()
+            for backup in [
+                backup for backup in backups_newest if backup["id"] in backup_ids_kept
+            ]:
+                # Objects shared with newer kept backups are only counted once
+                backup_size = backup.get("size", 0) + sum(
+                    [
+                        hash_size
+                        for (hash, hash_size) in backup["hashes"].items()
+                        if hash not in hashes
+                    ]
+                )
+                if size + backup_size > max_size and backup is not backups_newest[0]:
+                    backup_ids_kept.remove(backup["id"])
+                else:
+                    size += backup_size
+                    hashes.update(backup["hashes"])
+        return [backup for backup in backups if backup["id"] not in backup_ids_kept]
+
+    def manifest(self, backup_id):
+        with open(self.manifest_path(backup_id)) as fi:
+            return json.load(fi)
+
+    def _delete(self, backup_id):
+        backup = self._index().pop(backup_id, None)
+        try:
+            if backup is not None and "archive" in backup:
+                os.unlink(self.path + "/" + backup["archive"])
+            else:
+                os.unlink(self.manifest_path(backup_id))
+        except FileNotFoundError:
+            pass
+
+    def _collect_garbage(self):
+        # Live objects are those of the manifests on disk, not of the index
+        hashes = set()
+        for name in self._list_dir(self.path + "/manifests"):
+            if not name.endswith(".json"):
+                continue
+            try:
+                manifest = self.manifest(name[: -len(".json")])
+            except FileNotFoundError:
+                continue
+            except (IOError, OSError, ValueError):
+                # The objects of an unreadable manifest are unknown
+                return
+            hashes.update(self._index_entry(manifest)["hashes"])
+        object_names = set(
+            [hash + suffix for hash in hashes for suffix in self.SUFFIXES.values()]
+        )
+        for dir_name in self._list_dir(self.path + "/objects"):
+            dir_path = self.path + "/objects/" + dir_name
+            for name in self._list_dir(dir_path):
+                # Temporary files are left to their writer
+                if name not in object_names and self._is_object_name(name):
+                    os.unlink(dir_path + "/" + name)
+
+    def _is_object_name(self, name):
+        return any(
+            len(name) == 64 + len(suffix) and name.endswith(suffix)
+            for suffix in self.SUFFIXES.values()
+        )
+
+    def _index(self):
+        if self.index is None:
+            try:
+                with open(self.path + "/index.json") as fi:
+                    data = json.load(fi)
+                if data.get("version") == self.INDEX_VERSION:
+                    self.index = data["backups"]
+            except (IOError, OSError, ValueError):
+                pass
+            if self.index is None:
+                self.index = self._index_rebuild()
+                try:
+                    self._index_save()
+                except (IOError, OSError):
+                    # The index is rebuilt again next time, e.g. when listing
+                    # backups without write access
+                    pass
+        return self.index
+
+    def _index_reload(self):
+        # Under lock(): another process may have modified the index since it
+        # was loaded
+        self.index = None
+        return self._index()
+
+    def _index_rebuild(self):
+        index = {}
+        for name in self._list_dir(self.path + "/manifests"):
+            if not name.endswith(".json"):
+                continue
+            try:
+                manifest = self.manifest(name[: -len(".json")])
+            except (IOError, OSError, ValueError):
+                continue
+            index[manifest["id"]] = self._index_entry(manifest)
+        for name in self._list_dir(self.path):
+            match_result = self.LEGACY_ARCHIVE_REGEXP.match(name)
+            if match_result:
+                stat = os.stat(self.path + "/" + name)
+                index[match_result.group(1)] = {
+                    "id": match_result.group(1),
+                    "time": stat.st_mtime,
+                    "archive": name,
+                    "size": stat.st_size,
+                    "hashes": {},
+                }
+        return index
+
+    @classmethod
+    def _index_entry(cls, manifest):
+        return {
+            "id": manifest["id"],
+            "time": manifest["time"],
+            "files": len(manifest["files"]),
+            "hashes": dict(
+                [
+                    (file["hash"], file.get("size", 0))
+                    for file in manifest["files"]
+                    if file["hash"] is not None
+                ]
+            ),
+        }
+
+    def _index_save(self):
+        index_path = self.path + "/index.json"
+        temp_path = "%s.%d" % (index_path, os.getpid())
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(temp_path, "w") as fi:
+                json.dump({"version": self.INDEX_VERSION, "backups": self.index}, fi)
+            os.rename(temp_path, index_path)
+        except (IOError, OSError):
+            # An outdated index is removed, to be rebuilt from the manifests
+            for path in (temp_path, index_path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            raise
+
+    def _clone(self, source_path, dest_path, link):
+        if link:
+            try:
+                os.link(source_path, dest_path)
+                return
+            except OSError:
+                # E.g. not on the same filesystem
+                pass
+        with open(source_path, "rb") as fi:
+            with open(dest_path, "wb") as fo:
+                try:
+                    fcntl.ioctl(fo.fileno(), self.FICLONE, fi.fileno())
+                    return
+                except OSError:
+                    pass
+                if hasattr(os, "copy_file_range"):
+                    try:
+                        while os.copy_file_range(fi.fileno(), fo.fileno(), 1 << 30):
+                            pass
+                        return
+                    except OSError:
+                        fi.seek(0)
+                        fo.seek(0)
+                        fo.truncate()
+                shutil.copyfileobj(fi, fo)
+
+    def _restore_temp(self, hash, mode, file_path, owner=None):
+        # Writes object @hash next to @file_path, and returns its path
+        temp_path = file_path + ".sjconf"
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        sha256 = hashlib.sha256()
+        with self._open_object(hash) as fi:
+            with open(temp_path, "wb") as fo:
+                for chunk in iter(lambda: fi.read(65536), b""):
+                    sha256.update(chunk)
+                    fo.write(chunk)
+        if sha256.hexdigest() != hash:
+            # A hard linked file was modified in place
+            os.unlink(temp_path)
+            raise BackupCorruptedError(self.object_path(hash))
+        try:
+            if owner is not None:
+                stat = os.stat(temp_path)
+                if (stat.st_uid, stat.st_gid) != owner:
+                    os.chown(temp_path, *owner)
+            # After chown, which may clear the setuid and setgid bits
+            if mode is not None:
+                os.chmod(temp_path, mode)
+        except OSError:
+            os.unlink(temp_path)
+            raise
+        return temp_path
+
+    def _open_object(self, hash):
+        # The uncompressed object may be compressed meanwhile, by archive()
+        for compression in self.SUFFIXES:
+            try:
+                return self._open_compressed(
+                    self.object_path(hash, compression), "rb", compression
+                )
+            except FileNotFoundError:
+                pass
+        raise FileNotFoundError(self.object_path(hash))
+
+    def _open_compressed(self, path, mode, compression=None):
+        if compression is None:
+            compression = self.compression
+        level = self.level
+        if compression == "gz":
+            import gzip
+
+            return gzip.open(path, mode, compresslevel=9 if level is None else level)
+        elif compression == "xz":
+            import lzma
+
+            if "w" in mode:
+                return lzma.open(path, mode, preset=level)
+            return lzma.open(path, mode)
+        elif compression == "zstd":
+            import zstandard
+
+            if "w" in mode:
+                compressor = zstandard.ZstdCompressor(
+                    level=3 if level is None else level
+                )
+                return zstandard.open(path, mode, cctx=compressor)
+            return zstandard.open(path, mode)
+        return open(path, mode)
+
+    def _list_dir(self, path):
+        try:
+            return os.listdir(path)
+        except FileNotFoundError:
+            return []
+
+
+if __name__ == "__main__":
+    # Used by BackupStore.archive_detached: backup.py <path> <compression>
+    BackupStore(sys.argv[1], sys.argv[2]).archive()
@@ -0,0 +1,249 @@
+import os, json, stat
+
+
+def private_dir(dir_path):
+    """Creates the directory @dir_path, only accessible by its owner.
+
+    Returns whether the directory is usable: a directory owned by the
+    current user. An existing directory also accessible by others is made
+    private.
+    """
+    try:
+        os.makedirs(dir_path, mode=0o700, exist_ok=True)
+        dir_stat = os.lstat(dir_path)
+        if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.geteuid():
+            return False
+        if stat.S_IMODE(dir_stat.st_mode) & 0o077:
+            os.chmod(dir_path, 0o700)
+    except OSError:
+        return False
+    return True
+
+
+def private_file_read(file_path):
+    """Returns the content of @file_path, or None if it is missing or not
+    owned by the current user."""
+    try:
+        file_fd = os.open(file_path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(file_fd, "rb") as file:
+        if os.fstat(file.fileno()).st_uid != os.geteuid():
+            return None
+        return file.read()
+
+
+def file_write(file_path, data, mode):
+    """Atomically replaces @file_path by a file holding @data, with @mode."""
+    temp_path = "%s.%d" % (file_path, os.getpid())
+    try:
+        # Created with its mode, a leftover temporary file would keep its own
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+        file_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        with os.fdopen(file_fd, "wb") as file:
+            file.write(data)
+        os.rename(temp_path, file_path)
+    except:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class ParseCache:
+    """On-disk cache of parsed configuration files.
+
+    The cache is a directory holding one entry per configuration file and
+    parser type, so that caching a file only reads and writes its own entry.
+    Each entry holds the sections of the file, as returned by the parser,
+    and stays valid as long as the size, modification time and inode of the
+    file are unchanged.
+
+    The cache holds the values of local.conf, so the directory and its
+    entries are only accessible by their owner, and entries not owned by
+    the current user are ignored.
+    """
+
+    VERSION = 2
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        # Whether the cache directory is usable, see private_dir
+        self.usable = None
+        # Entries to write by save, by entry path
+        self.entries_pending = {}
+        # Whether entries were written since drop_deleted
+        self.written = False
+
+    def get(self, file_path, parser_type, stat_key):
+        """Returns the cached sections of @file_path, or None if outdated."""
+        if not self._usable():
+            return None
+        entry = self._entry_load(self._entry_path(file_path, parser_type))
+        if (
+            entry is None
+            or entry["file_path"] != file_path
+            or entry["parser_type"] != parser_type
+            or entry["stat"] != stat_key
+        ):
+            return None
+        return entry["sections"]
+
+    def set(self, file_path, parser_type, stat_key, sections):
+        self.entries_pending[self._entry_path(file_path, parser_type)] = {
+            "version": self.VERSION,
+            "file_path": file_path,
+            "parser_type": parser_type,
+            "stat": stat_key,
+            "sections": sections,
+        }
+
+    def save(self):
+        """Writes the entries set since the last save."""
+        entries_pending = self.entries_pending
+        self.entries_pending = {}
+        if not entries_pending or not self._usable():
+            return
+        for (entry_path, entry) in entries_pending.items():
+            try:
+                file_write(entry_path, json.dumps(entry).encode("utf-8"), 0o600)
+            except (IOError, OSError):
+                # The cache is an optimization only
+                continue
+            self.written = True
+
+    def drop_deleted(self):
+        """Deletes the entries of deleted files, if entries were written."""
+        if not self.written:
+            return
+        self.written = False
+        # Written by former versions, before the cache was a directory
+        for file_path in [self.cache_path + ".json"] + [
+            self.cache_path + "/" + name
+            for name in self._list_dir()
+            if name.endswith(".json")
+        ]:
+            entry = self._entry_load(file_path)
+            if entry is not None and os.path.exists(entry["file_path"]):
+                continue
+            try:
+                os.unlink(file_path)
+            except OSError:
+                pass
+
+    @classmethod
+    def stat_key(cls, file_path):
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def _usable(self):
+        if self.usable is None:
+            self.usable = private_dir(self.cache_path)
+        return self.usable
+
+    def _entry_path(self, file_path, parser_type):
+        import hashlib
+
+        key = hashlib.sha256(
+            (parser_type + ":" + file_path).encode("utf-8", "surrogateescape")
+        ).hexdigest()
+        return "%s/%s.json" % (self.cache_path, key)
+
+    def _entry_load(self, entry_path):
+        data = private_file_read(entry_path)
+        if data is None:
+            return None
+        try:
+            entry = json.loads(data)
+        except ValueError:
+            return None
+        if not isinstance(entry, dict) or entry.get("version") != self.VERSION:
+            return None
+        return entry
+
+    def _list_dir(self):
+        try:
+            return os.listdir(self.cache_path)
+        except OSError:
+            return []
+
+
+class PluginManifest:
+    """On-disk manifest of the metadata of the installed plugins.
+
+    Each entry holds the metadata of one plugin, as recorded by PluginInfo,
+    and stays valid as long as the size, modification time and inode of the
+    plugin file, or of each source file of a plugin package, are unchanged.
+    """
+
+    VERSION = 2
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.entries = None
+        self.modified = False
+
+    @classmethod
+    def stat_key(cls, plugin_path):
+        if not os.path.isdir(plugin_path):
+            return ParseCache.stat_key(plugin_path)
+        stat_key = []
+        for (dir_path, dir_names, file_names) in os.walk(plugin_path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name.endswith(".py"):
+                    file_path = dir_path + "/" + file_name
+                    stat_key.append(
+                        [os.path.relpath(file_path, plugin_path)]
+                        + ParseCache.stat_key(file_path)
+                    )
+        return stat_key
+
+    def get(self, plugin_name, stat_key):
+        """Returns the metadata of @plugin_name, or None if outdated."""
+        self._load()
+        entry = self.entries.get(plugin_name)
+        if entry is None or entry["stat"] != stat_key:
+            return None
+        return entry["plugin"]
+
+    def set(self, plugin_name, stat_key, metadata):
+        self._load()
+        self.entries[plugin_name] = {"stat": stat_key, "plugin": metadata}
+        self.modified = True
+
+    def delete(self, plugin_name):
+        self._load()
+        if self.entries.pop(plugin_name, None) is not None:
+            self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        try:
+            file_write(
+                self.manifest_path,
+                json.dumps({"version": self.VERSION, "entries": self.entries}).encode(
+                    "utf-8"
+                ),
+                0o644,
+            )
+        except (IOError, OSError):
+            # The manifest is an optimization only, e.g. plugins may be
+            # listed by users without write access to it
+            return
+        self.modified = False
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            with open(self.manifest_path) as manifest_file:
+                data = json.load(manifest_file)
+        except (IOError, OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == self.VERSION:
+            self.entries = data["entries"]
@@ -1,6 +1,6 @@
 from sjconfparts.type import *
 from sjconfparts.exceptions import *
-import os, re, configparser, errno
+import os, re, configparser, errno, contextlib
 
 
 class Conf:
@@ -32,23 +32,142 @@ class Conf:
                 % (conf_name1, conf_name2, key, section)
             )
 
+    class TrackedDict(dict):
+        """Dictionary reporting its modified keys to a tracker.
+
+        The tracker is called with the name given to track_changes and the
+        modified key.
+        """
+
+        def __init__(self, *args, **kw):
+            dict.__init__(self, *args, **kw)
+            self.tracker = None
+            self.name = None
+
+        def track_changes(self, tracker, name):
+            self.tracker = tracker
+            self.name = name
+
+        def _changed(self, key):
+            if self.tracker is not None:
+                self.tracker(self.name, key)
+
+        def __setitem__(self, key, value):
+            changed = key not in self or dict.__getitem__(self, key) != value
+            dict.__setitem__(self, key, value)
+            if changed:
+                self._changed(key)
+
+        def __delitem__(self, key):
+            dict.__delitem__(self, key)
+            self._changed(key)
+
+        def setdefault(self, key, value=None):
+            if key not in self:
+                self[key] = value
+            return dict.__getitem__(self, key)
+
+        def pop(self, key, *args):
+            present = key in self
+            value = dict.pop(self, key, *args)
+            if present:
+                self._changed(key)
+            return value
+
+        def popitem(self):
+            (key, value) = dict.popitem(self)
+            self._changed(key)
+            return (key, value)
+
+        def clear(self):
+            keys = list(self.keys())
+            dict.clear(self)
+            for key in keys:
+                self._changed(key)
+
+        def update(self, *args, **kw):
+            for (key, value) in dict(*args, **kw).items():
+                self[key] = value
+
     class ConfSection:
+
+        TYPED_KEY_REGEXP = re.compile(r"(.*)_([^_]+)$")
+
+        SEQUENCE_KEY_REGEXP = re.compile(r"^(.*)-\d+$")
+
+        SEQUENCE_PATTERN_SUFFIX = r"(-\d+)?$"
+
         def __init__(self, dictionary={}):
-            self.dict = dict(dictionary)
+            self.dict = Conf.TrackedDict(dictionary)
             self.types = {}
             self.type_values = {}
+            # Index of self.types: each type pattern keeps the position it
+            # has in self.types, so that the first matching one wins
+            self.type_positions = {}
+            self.type_position_next = 0
+            self.type_patterns = []
+            self.sequence_types = {}
+            self.type_cache = {}
+            # State of batch(): lists whose conversion is deferred, and typed
+            # keys still to convert to their string representation
+            self.batch_depth = 0
+            self.batch_lists = []
+            self.batch_keys = {}
             if hasattr(dictionary, "get_types"):
                 for (key, type) in dictionary.get_types().items():
                     self.set_type(key, type)
 
         def __delitem__(self, key):
             del self.dict[key]
-            if key in self.type_values:
-                del self.type_values[key]
+            self._drop_typed_value(key)
+
+        def __contains__(self, key):
+            return self.dict.__contains__(key)
+
+        def track_changes(self, tracker, name):
+            """Report each modified key of this section to @tracker."""
+            self.dict.track_changes(tracker, name)
+
+        @contextlib.contextmanager
+        def batch(self):
+            """Defer the string conversion of typed values to the end of the block.
+
+            Until then, the string values of the modified typed keys are
+            outdated.
+            """
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if self.batch_depth == 0:
+                    self._batch_flush()
+
+        def _batch_flush(self):
+            batch_lists = self.batch_lists
+            batch_keys = self.batch_keys
+            self.batch_lists = []
+            self.batch_keys = {}
+            values_converted = []
+            for (key, (type, value)) in batch_keys.items():
+                Type.convert(type, "str", {key: value}, self.dict, key)
+                values_converted.append(value)
+            for list_object in batch_lists:
+                list_object.batch_end(convert=list_object not in values_converted)
+
+        def _batch_value(self, value):
+            if (
+                self.batch_depth > 0
+                and isinstance(value, ConversionList)
+                and value not in self.batch_lists
+            ):
+                value.batch_begin()
+                self.batch_lists.append(value)
+            return value
 
         def _find_type_of(self, key):
             type = None
-            search_result = re.compile(r"(.*)_([^_]+)$").search(key)
+            search_result = self.TYPED_KEY_REGEXP.search(key)
             if search_result:
                 key_tmp = search_result.group(1)
                 type = search_result.group(2)
@@ -59,36 +178,128 @@ class Conf:
             return key, type
 
         def _find_type_for(self, key):
+            try:
+                return self.type_cache[key]
+            except KeyError:
+                pass
             type = None
             if key in self.types:
                 type = self.types[key]
             else:
-                for type_to_test in self.types:
-                    if hasattr(type_to_test, "search") and type_to_test.search(key):
-                        type = self.types[type_to_test]
+                # Literal sequence patterns are looked up by key, other
+                # patterns are only tested if they come before
+                position = None
+                match_result = self.SEQUENCE_KEY_REGEXP.match(key)
+                for sequence_key in (key, match_result and match_result.group(1)):
+                    if sequence_key in self.sequence_types:
+                        pattern = self.sequence_types[sequence_key]
+                        if position is None or self.type_positions[pattern] < position:
+                            position = self.type_positions[pattern]
+                            type = self.types[pattern]
+                for pattern in self.type_patterns:
+                    if position is not None and self.type_positions[pattern] > position:
                         break
+                    if pattern.search(key):
+                        type = self.types[pattern]
+                        break
+            self.type_cache[key] = type
             return type
 
+        def _sequence_key(self, pattern):
+            # Returns the key of a pattern built by Type.Sequence.key_for_search,
+            # provided it has no special character
+            if pattern.flags != re.compile("").flags:
+                return None
+            pattern_str = pattern.pattern
+            if not pattern_str.startswith("^") or not pattern_str.endswith(
+                self.SEQUENCE_PATTERN_SUFFIX
+            ):
+                return None
+            key = pattern_str[1 : -len(self.SEQUENCE_PATTERN_SUFFIX)]
+            if re.escape(key) != key:
+                return None
+            return key
+
+        def _index_type(self, key):
+            self.type_cache.clear()
+            if key in self.type_positions or not hasattr(key, "search"):
+                return
+            self.type_positions[key] = self.type_position_next
+            self.type_position_next += 1
+            sequence_key = self._sequence_key(key)
+            if sequence_key is not None and sequence_key not in self.sequence_types:
+                self.sequence_types[sequence_key] = key
+            else:
+                self.type_patterns.append(key)
+
+        def _unindex_type(self, key):
+            self.type_cache.clear()
+            if key not in self.type_positions:
+                return
+            del self.type_positions[key]
+            sequence_key = self._sequence_key(key)
+            if self.sequence_types.get(sequence_key) == key:
+                del self.sequence_types[sequence_key]
+            else:
+                self.type_patterns.remove(key)
+
         def __getitem__(self, key):
             key, type = self._find_type_of(key)
             if type:
-                value = self.type_values[key]
+                value = self._typed_value(key, type)
             else:
                 value = self.dict[key]
             return value
 
+        def _typed_value(self, key, type):
+            # Typed values are only built on first access
+            if key not in self.type_values:
+                if not self._has_typed_value(key, type):
+                    raise KeyError(key)
+                Type.convert("str", type, self.dict, self.type_values, key)
+            return self._batch_value(self.type_values[key])
+
+        def _has_typed_value(self, key, type):
+            if key in self.dict:
+                return True
+            # Some types (e.g. sequence) are stored under several keys
+            for key_to_test in self.dict:
+                if (
+                    Type.convert_key(key_to_test, type) == key
+                    and self._find_type_for(key_to_test) == type
+                ):
+                    return True
+            return False
+
+        def _drop_typed_value(self, key):
+            # Called when the string value of key changes
+            type = self._find_type_for(key)
+            if type:
+                key = Type.convert_key(key, type)
+            value = self.type_values.pop(key, None)
+            if self.batch_depth > 0:
+                # The string value was set afterwards, it must be kept
+                self.batch_keys.pop(key, None)
+                if value is not None and value in self.batch_lists:
+                    self.batch_lists.remove(value)
+                    value.batch_end(convert=False)
+
         def __setitem__(self, key, value):
             key, type = self._find_type_of(key)
             if type:
                 self.type_values[key] = Type.convert_value(
                     value, type, self.dict, self.type_values, key
                 )
-                Type.convert(type, "str", self.type_values, self.dict, key)
+                if self.batch_depth > 0:
+                    self.batch_keys[key] = (
+                        type,
+                        self._batch_value(self.type_values[key]),
+                    )
+                else:
+                    Type.convert(type, "str", self.type_values, self.dict, key)
             else:
                 self.dict[key] = value
-                type = self._find_type_for(key)
-                if type:
-                    Type.convert("str", type, self.dict, self.type_values, key)
+                self._drop_typed_value(key)
 
         def update(self, other_dict):
             for (key, value) in other_dict.items():
@@ -99,14 +310,15 @@ class Conf:
                 self[key] = value
 
         def set_type(self, key, type):
-            self.types[Type.convert_key_for_search(key, type)] = type
-            keys = [
-                key_matched
-                for key_matched in self.dict
-                if self._find_type_for(key_matched) == type
-            ]
-            for key in keys:
-                Type.convert("str", type, self.dict, self.type_values, key)
+            key_for_search = Type.convert_key_for_search(key, type)
+            self.types[key_for_search] = type
+            self._index_type(key_for_search)
+            for key in [
+                key_typed
+                for key_typed in self.type_values
+                if self._find_type_for(key_typed) == type
+            ]:
+                del self.type_values[key]
 
         def get_type(self, key):
             # Raise KeyError in key not defined
@@ -117,6 +329,7 @@ class Conf:
             if not key in self.types and type is not None:
                 key = Type.convert_key_for_search(key, type)
             del self.types[key]
+            self._unindex_type(key)
 
         def get_types(self):
             return self.types
@@ -133,12 +346,16 @@ class Conf:
         file_path=None,
         conf_section_class=ConfSection,
         parser_type="magic",
+        cache=None,
     ):
         self.conf_section_class = conf_section_class
         self.dict = dict({})
         self.file_path = file_path
+        self.parser_type = parser_type
+        self.cache = cache
         self.comments = None
         self.types = {}
+        self.tracker = None
         if parser_type == "raw":
             self.config_parser_class = configparser.RawConfigParser
         else:
@@ -152,9 +369,11 @@ class Conf:
 
     def __setitem__(self, key, value):
         self.dict[key] = self._value_to_section(key, value)
+        self._section_changed(key)
 
     def __delitem__(self, key):
         del self.dict[key]
+        self._section_changed(key)
 
     def __getitem__(self, key):
         return self.dict[key]
@@ -166,7 +385,25 @@ class Conf:
         return self.dict.__iter__()
 
     def setdefault(self, key, value=None):
-        return self.dict.setdefault(key, self._value_to_section(key, value))
+        if key not in self.dict:
+            self[key] = value
+        return self.dict[key]
+
+    def track_changes(self, tracker):
+        """Report each modified (section, key) pair to @tracker.
+
+        @tracker is called with the section name and the key, key being None
+        when a whole section is added, replaced or deleted.
+        """
+        self.tracker = tracker
+        for (section_name, section) in self.dict.items():
+            section.track_changes(tracker, section_name)
+
+    def _section_changed(self, section_name):
+        if self.tracker is not None:
+            if section_name in self.dict:
+                self.dict[section_name].track_changes(self.tracker, section_name)
+            self.tracker(section_name, None)
 
     def update(self, other_dict):
         for section in other_dict:
@@ -178,6 +415,7 @@ class Conf:
                 else:
                     value = other_dict[section]
                 self.dict[section] = value
+                self._section_changed(section)
         if hasattr(other_dict, "get_types"):
             for (key, type) in other_dict.get_types().items():
                 self.set_type(self, key, type)
@@ -230,10 +468,18 @@ class Conf:
                 raise IOError(
                     errno.EISDIR, "%s: %s" % (self.file_path, os.strerror(errno.EISDIR))
                 )
-            cp = self.config_parser_class()
-            cp.read(file_path)
-            for section in cp.sections():
-                self.dict[section] = self.conf_section_class(cp.items(section))
+            sections = None
+            if self.cache:
+                stat_key = self.cache.stat_key(file_path)
+                sections = self.cache.get(file_path, self.parser_type, stat_key)
+            if sections is None:
+                cp = self.config_parser_class()
+                cp.read(file_path)
+                sections = [(section, cp.items(section)) for section in cp.sections()]
+                if self.cache:
+                    self.cache.set(file_path, self.parser_type, stat_key, sections)
+            for (section, items) in sections:
+                self.dict[section] = self.conf_section_class(items)
 
     def save(self, output_file=None):
         opened = False
@@ -295,8 +541,11 @@ class Conf:
     def _value_to_section(self, key, value):
         if value.__class__ != self.conf_section_class:
             value = self.conf_section_class(value)
+        self._apply_types(key, value)
+        return value
+
+    def _apply_types(self, key, value):
         for (section, types) in self.types.items():
             if section == key or (hasattr(section, "search") and section.search(key)):
                 for type in types:
                     value.set_type(*type)
-        return value
@@ -0,0 +1,196 @@
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def version_compare(version_a, version_b):
+    """Compares two Debian versions, as apt_pkg.version_compare.
+
+    Returns a negative number, zero or a positive number if @version_a is
+    lower than, equal to or greater than @version_b. Uses apt_pkg when
+    installed, else a pure Python implementation. Results are memoized.
+    """
+    apt_pkg = _apt_pkg()
+    if apt_pkg is None:
+        return debian_version_compare(version_a, version_b)
+    return apt_pkg.version_compare(version_a, version_b)
+
+
+@functools.lru_cache(maxsize=None)
+def _apt_pkg():
+    # Imported and initialized once, and only when versions are compared
+    try:
+        import apt_pkg
+    except ImportError:
+        return None
+    apt_pkg.init_system()
+    return apt_pkg
+
+
+def debian_version_compare(version_a, version_b):
+    """Compares two Debian versions ([epoch:]upstream[-revision]), as dpkg."""
+    (epoch_a, upstream_a, revision_a) = _debian_version_split(version_a)
+    (epoch_b, upstream_b, revision_b) = _debian_version_split(version_b)
+    if epoch_a != epoch_b:
+        return epoch_a < epoch_b and -1 or 1
+    return _debian_version_part_compare(
+        upstream_a, upstream_b
+    ) or _debian_version_part_compare(revision_a, revision_b)
+
+
+def _debian_version_split(version):
+    epoch = 0
+    if ":" in version:
+        (epoch_str, version) = version.split(":", 1)
+        try:
+            epoch = int(epoch_str)
+        except ValueError:
+            pass
+    revision = ""
+    if "-" in version:
+        (version, revision) = version.rsplit("-", 1)
+    return (epoch, version, revision)
+
+
+def _debian_version_order(char):
+    # Letters sort before non letters, and "~" before anything, even the end
+    if char == "":
+        return 0
+    if char == "~":
+        return -1
+    if char.isalpha():
+        return ord(char)
+    return ord(char) + 256
+
+
+def _debian_version_part_compare(part_a, part_b):
+    # Alternates non digit parts, compared char by char, and digit parts,
+    # compared as numbers
+    digits = "0123456789"
+    i = j = 0
+    while i < len(part_a) or j < len(part_b):
+        while (i < len(part_a) and part_a[i] not in digits) or (
+            j < len(part_b) and part_b[j] not in digits
+        ):
+            order_a = _debian_version_order(
+                i < len(part_a) and part_a[i] not in digits and part_a[i] or ""
+            )
+            order_b = _debian_version_order(
+                j < len(part_b) and part_b[j] not in digits and part_b[j] or ""
+            )
+            if order_a != order_b:
+                return order_a < order_b and -1 or 1
+            i += 1
+            j += 1
+        number_start_a = i
+        while i < len(part_a) and part_a[i] in digits:
+            i += 1
+        number_start_b = j
+        while j < len(part_b) and part_b[j] in digits:
+            j += 1
+        number_a = int(part_a[number_start_a:i] or "0")
+        number_b = int(part_b[number_start_b:j] or "0")
+        if number_a != number_b:
+            return number_a < number_b and -1 or 1
+    return 0
+
+
+class PluginGraph:
+    """Dependency graph of a set of plugins.
+
+    Built once from the plugins, with the names of the enabled and of the
+    installed plugins, it verifies the dependencies and gives the order of
+    the plugins, each one after the plugins it depends on. Plugins of a
+    dependency cycle are ordered by name, and the cycles are listed in
+    @cycles.
+    """
+
+    def __init__(self, plugins, enabled_plugin_names, installed_plugin_names):
+        self.plugins = dict([(plugin.name(), plugin) for plugin in plugins])
+        self.enabled_plugin_names = set(enabled_plugin_names)
+        self.installed_plugin_names = set(installed_plugin_names)
+        # Names of the plugins each plugin depends on, among the plugins
+        self.dependency_names = dict(
+            [
+                (
+                    plugin.name(),
+                    sorted(
+                        set(
+                            [
+                                dependency.name
+                                for dependency in plugin.dependencies()
+                                if dependency.name in self.plugins
+                                and dependency.name != plugin.name()
+                            ]
+                        )
+                    ),
+                )
+                for plugin in plugins
+            ]
+        )
+        self.cycles = []
+        self._order = None
+
+    def verify(self, plugin, dependency):
+        """Verifies @dependency of @plugin, raising a Plugin.Dependency.Error."""
+        from sjconfparts.plugin import Plugin
+
+        if (
+            not dependency.name in self.enabled_plugin_names
+            and not dependency.optional
+        ):
+            if dependency.name in self.installed_plugin_names:
+                raise Plugin.Dependency.NotEnabledError(plugin.name(), dependency.name)
+            raise Plugin.Dependency.NotInstalledError(plugin.name(), dependency.name)
+        if (
+            dependency.name in self.enabled_plugin_names
+            and dependency.name in self.plugins
+        ):
+            dependency.verify(self.plugins[dependency.name].version())
+
+    def dependencies(self, plugin):
+        """Returns the plugins @plugin depends on, by name, once verified."""
+        plugin_dependencies_hash = {}
+        for dependency in plugin.dependencies():
+            if not dependency.name in self.plugins and dependency.optional:
+                continue
+            self.verify(plugin, dependency)
+            plugin_dependencies_hash[dependency.name] = self.plugins[dependency.name]
+        return plugin_dependencies_hash
+
+    def order(self):
+        """Returns the plugin names, each one after its dependencies."""
+        if self._order is None:
+            self._order = []
+            dependency_names = dict(
+                [
+                    (plugin_name, set(self.dependency_names[plugin_name]))
+                    for plugin_name in self.dependency_names
+                ]
+            )
+            while dependency_names:
+                plugin_names = sorted(
+                    [
+                        plugin_name
+                        for plugin_name in dependency_names
+                        if not dependency_names[plugin_name]
+                    ]
+                )
+                if not plugin_names:
+                    plugin_names = self._cycle(dependency_names)
+                    self.cycles.append(plugin_names)
+                for plugin_name in plugin_names:
+                    del dependency_names[plugin_name]
+                for plugin_dependency_names in dependency_names.values():
+                    plugin_dependency_names.difference_update(plugin_names)
+                self._order.extend(plugin_names)
+        return list(self._order)
+
+    def _cycle(self, dependency_names):
+        # Returns the plugins of a cycle, sorted by name: following
+        # dependencies from any plugin eventually comes back to a plugin
+        path = [min(dependency_names)]
+        while True:
+            plugin_name = min(dependency_names[path[-1]])
+            if plugin_name in path:
+                return sorted(path[path.index(plugin_name) :])
+            path.append(plugin_name)
@@ -63,3 +63,69 @@ class PluginsNotExistError(Error):
             + " do%s " % (len(plugins) == 1 and "es" or "")
             + "not exist"
         )
+
+
+class BatchError(Error):
+    def __init__(self, line_number, msg):
+        self.line_number = line_number
+        self.msg = "Batch line %d: %s" % (line_number, msg)
+
+
+class ServiceError(Error):
+    def __init__(self, action, failures):
+        self.action = action
+        self.failures = failures
+        self.msg = "Failed to %s service%s: " % (
+            action,
+            len(failures) > 1 and "s" or "",
+        ) + ", ".join(
+            "%s (%s)" % (service, failures[service]) for service in sorted(failures)
+        )
+
+
+class BackupCompressionError(Error):
+    def __init__(self, compression, reason=None):
+        self.msg = 'Invalid backup compression "%s"' % (compression)
+        if reason:
+            self.msg += ": %s" % (reason)
+
+
+class BackupRetentionError(Error):
+    def __init__(self, key, value, expected):
+        self.msg = 'Invalid value "%s" for %s, expected %s' % (value, key, expected)
+
+
+class BackupCorruptedError(Error):
+    def __init__(self, object_path):
+        self.msg = "Backup object %s does not match its hash" % (object_path)
+
+
+class BackupNotFoundError(Error):
+    def __init__(self, backup_id=None):
+        if backup_id is None:
+            self.msg = "No backup found"
+        else:
+            self.msg = "Backup %s not found" % (backup_id)
+
+
+class BackupArchiveError(Error):
+    def __init__(self, archive_path):
+        self.msg = (
+            "Backup %s predates the backup store, please restore files manually from it"
+            % (archive_path)
+        )
+
+
+class TemplateError(Error):
+    def __init__(self, template_path, line_number, msg):
+        self.template_path = template_path
+        self.line_number = line_number
+        if line_number is None:
+            self.msg = "Template %s: %s" % (template_path, msg)
+        else:
+            self.msg = "Template %s, line %d: %s" % (template_path, line_number, msg)
+
+
+class TemplateEngineNotFoundError(Error):
+    def __init__(self, name):
+        self.msg = "Template engine %s does not exist" % (name)
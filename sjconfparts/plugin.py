@@ -1,9 +1,9 @@
 import os
-
-import apt_pkg
+import threading
 
 import sjconfparts.exceptions
 from sjconfparts.conf import *
+from sjconfparts.dependency import *
 
 
 class Plugin:
@@ -27,6 +27,10 @@ class Plugin:
         def __init__(self, plugin_name):
             self.msg = "Plugin not enabled: %s" % (plugin_name)
 
+    class LoadError(Error):
+        def __init__(self, plugin_name, exception):
+            self.msg = "Unable to load plugin %s: %s" % (plugin_name, exception)
+
     class Dependency:
         """Dependency helper class.
 
@@ -84,53 +88,26 @@ class Plugin:
                     raise BadRequirementTypeError(self.plugin.name(), self.name, key)
             self.requirements = requirements
 
-        def verify(self, version):
-            apt_pkg.init_system()
+        # Condition on the version comparison of each requirement type
+        REQUIREMENTS = (
+            ("=", lambda comparison: comparison == 0),
+            (">", lambda comparison: comparison > 0),
+            (">=", lambda comparison: comparison >= 0),
+            ("<", lambda comparison: comparison < 0),
+            ("<=", lambda comparison: comparison <= 0),
+        )
 
-            if "=" in self.requirements:
-                if not apt_pkg.version_compare(version, self.requirements["="]) == 0:
-                    raise Plugin.Dependency.BadVersionError(
-                        self.plugin.name(),
-                        self.name,
-                        version,
-                        "=",
-                        self.requirements["="],
-                    )
-            if ">" in self.requirements:
-                if not apt_pkg.version_compare(version, self.requirements[">"]) > 0:
-                    raise Plugin.Dependency.BadVersionError(
-                        self.plugin.name(),
-                        self.name,
-                        version,
-                        ">",
-                        self.requirements[">"],
-                    )
-            if ">=" in self.requirements:
-                if not apt_pkg.version_compare(version, self.requirements[">="]) >= 0:
-                    raise Plugin.Dependency.BadVersionError(
-                        self.plugin.name(),
-                        self.name,
-                        version,
-                        ">=",
-                        self.requirements[">="],
-                    )
-            if "<" in self.requirements:
-                if not apt_pkg.version_compare(version, self.requirements["<"]) < 0:
-                    raise Plugin.Dependency.BadVersionError(
-                        self.plugin.name(),
-                        self.name,
-                        version,
-                        "<",
-                        self.requirements["<"],
-                    )
-            if "<=" in self.requirements:
-                if not apt_pkg.version_compare(version, self.requirements["<="]) <= 0:
+        def verify(self, version):
+            for (requirement, condition) in self.REQUIREMENTS:
+                if requirement in self.requirements and not condition(
+                    version_compare(version, self.requirements[requirement])
+                ):
                     raise Plugin.Dependency.BadVersionError(
                         self.plugin.name(),
                         self.name,
                         version,
-                        "<=",
-                        self.requirements["<="],
+                        requirement,
+                        self.requirements[requirement],
                     )
 
     class File:
@@ -145,6 +122,8 @@ class Plugin:
             self.backed_up = False
             self.written = False
             self.plugin_name = plugin_name
+            # Whether content differs from the file on disk, None until known
+            self.changed = None
 
     def __init__(self, plugin_name, sjconf, conf):
         self.plugin_name = plugin_name
@@ -189,6 +168,14 @@ class Plugin:
         """
         return ()
 
+    def services_ordering(self):
+        """List of (service, service) pairs ordering restarts and reloads.
+
+        The first service of each pair is restarted (or reloaded) before the
+        second one, if both are. Other services are run concurrently.
+        """
+        return ()
+
     def conf_files_path(self):
         """List of configuration file path."""
         return ()
@@ -259,9 +246,114 @@ class Plugin:
         )
 
 
+class PluginInfo:
+    """Metadata of a plugin: name, version and dependencies.
+
+    Provides these methods of Plugin from the metadata recorded in the
+    plugin manifest, without importing the plugin. The other methods, which
+    may depend on the configuration, are those of the plugin, loaded by
+    @plugin_loader on first use.
+    """
+
+    def __init__(self, metadata, plugin_loader=None):
+        self.metadata = metadata
+        self.plugin_loader = plugin_loader
+        self.plugin = None
+
+    @classmethod
+    def from_plugin(cls, plugin):
+        """Records the metadata of the Plugin instance @plugin."""
+        version = plugin.version()
+        plugin_info = cls(
+            {
+                "name": plugin.name(),
+                "version": isinstance(version, str) and version or str(version),
+                "dependencies": [
+                    {
+                        "name": dependency.name,
+                        "optional": dependency.optional,
+                        "requirements": dependency.requirements,
+                    }
+                    for dependency in plugin.dependencies()
+                ],
+            }
+        )
+        plugin_info.plugin = plugin
+        return plugin_info
+
+    def __getattr__(self, name):
+        if self.plugin is None:
+            if self.plugin_loader is None:
+                raise AttributeError(name)
+            self.plugin = self.plugin_loader(self.name())
+        return getattr(self.plugin, name)
+
+    def name(self):
+        return self.metadata["name"]
+
+    def version(self):
+        return self.metadata["version"]
+
+    def dependencies(self):
+        return tuple(
+            Plugin.Dependency(
+                self,
+                dependency["name"],
+                optional=dependency["optional"],
+                requirements=dependency["requirements"],
+            )
+            for dependency in self.metadata["dependencies"]
+        )
+
+
 class PluginWithTemplate(Plugin):
     """Template based SJConf base plugin."""
 
+    # Compiled templates, by engine name and path, shared by all plugins
+    templates = {}
+    templates_lock = threading.Lock()
+
+    @classmethod
+    def template(cls, template_path, engine=None):
+        """Returns the template @template_path compiled by @engine.
+
+        Templates are read and compiled once, then only again when their
+        modification time, size or inode change. Without @engine, the
+        template is returned as text.
+        """
+        if engine is None:
+            from sjconfparts.template import PercentTemplateEngine
+
+            engine = PercentTemplateEngine()
+        stat = os.stat(template_path)
+        stat_key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with cls.templates_lock:
+            if (engine.NAME, template_path) in cls.templates:
+                (template_stat_key, template) = cls.templates[
+                    (engine.NAME, template_path)
+                ]
+                if template_stat_key == stat_key:
+                    return template
+        with open(template_path) as fi:
+            template = engine.compile(fi.read(), template_path)
+        with cls.templates_lock:
+            cls.templates[(engine.NAME, template_path)] = (stat_key, template)
+        return template
+
+    def template_engine(self, file_path):
+        """Template engine for @file_path's template.
+
+        Uses the engine named by the template_engine key of the plugin
+        section, "percent" by default.
+
+        @see: sjconfparts.template.TemplateEngine
+        """
+        if self.name() in self.conf and "template_engine" in self.conf[self.name()]:
+            return self.sjconf.template_engine(
+                self.conf[self.name()]["template_engine"]
+            )
+        return self.sjconf.template_engine("percent")
+
     def template_path(self, file_path, confs_to_test=None):
         """Provide template path for @file_path configuration file.
 
@@ -305,4 +397,5 @@ class PluginWithTemplate(Plugin):
         if self.name() in self.conf:
             confs_to_test.append(self.conf[self.name()])
         template_path = self.template_path(file_path, confs_to_test)
-        return open(template_path).read() % template_conf
+        engine = self.template_engine(file_path)
+        return engine.render(self.template(template_path, engine), template_conf)
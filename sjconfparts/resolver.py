@@ -0,0 +1,247 @@
+import collections.abc
+import functools
+
+from sjconfparts.conf import *
+
+
+class Resolver:
+    """Configuration layers resolver.
+
+    Owns the base, profile and local configuration layers, and memoizes
+    their merged views. Modifications of the layers are tracked by
+    (section, key), and only the modified keys of a merged view are patched
+    the next time it is requested.
+
+    Each merged view is indexed by section prefix, the part of the section
+    name before ":", which is the name of the plugin owning the section.
+    """
+
+    LAYERS = ("base", "profile", "local")
+
+    class SectionsView(collections.abc.MutableMapping):
+        """Live mapping of the sections of a merged view having a prefix.
+
+        The sections are looked up through the index of the merged view,
+        which is patched or rebuilt when needed, on each access.
+        """
+
+        def __init__(self, resolver, layers, prefix):
+            self.resolver = resolver
+            self.layers = layers
+            self.prefix = prefix
+
+        def _sections(self):
+            conf = self.resolver.merged(self.layers)
+            section_names = self.resolver.sections_indexes[self.layers].get(
+                self.prefix, ()
+            )
+            return (conf, section_names)
+
+        def __getitem__(self, section_name):
+            (conf, section_names) = self._sections()
+            if section_name not in section_names:
+                raise KeyError(section_name)
+            return conf.dict[section_name]
+
+        def __setitem__(self, section_name, section):
+            (conf, section_names) = self._sections()
+            if Resolver.section_prefix(section_name) != self.prefix:
+                raise KeyError(section_name)
+            conf.dict[section_name] = section
+            self.resolver._index_add(self.layers, section_name)
+
+        def __delitem__(self, section_name):
+            (conf, section_names) = self._sections()
+            if section_name not in section_names:
+                raise KeyError(section_name)
+            del conf.dict[section_name]
+            self.resolver._index_remove(self.layers, section_name)
+
+        def __iter__(self):
+            return iter(list(self._sections()[1]))
+
+        def __len__(self):
+            return len(self._sections()[1])
+
+    def __init__(self):
+        self.layers = {}
+        self.views = {}
+        self.changes = {}
+        # Section names of each merged view, by prefix, see sections
+        self.sections_indexes = {}
+        # Shared views of the sections of a prefix, by (layers, prefix)
+        self.sections_views = {}
+
+    def __getitem__(self, layer):
+        return self.layers[layer]
+
+    def __setitem__(self, layer, conf):
+        self.layers[layer] = conf
+        conf.track_changes(functools.partial(self._changed, layer))
+        self.invalidate(layer)
+
+    def __delitem__(self, layer):
+        del self.layers[layer]
+        self.invalidate(layer)
+
+    def __contains__(self, layer):
+        return self.layers.__contains__(layer)
+
+    def __iter__(self):
+        return self.layers.__iter__()
+
+    def invalidate(self, layer=None):
+        """Drop the merged views depending on @layer (all views if None)."""
+        for layers in list(self.views.keys()):
+            if layer is None or layer in layers:
+                del self.views[layers]
+                del self.changes[layers]
+                del self.sections_indexes[layers]
+
+    def merged(self, layers=LAYERS):
+        """Returns the merged view of @layers, from the lowest to the highest.
+
+        The returned Conf is shared: callers willing to modify it must work
+        on a copy.
+        """
+        layers = tuple(layers)
+        if layers not in self.views:
+            self.views[layers] = self._merge(layers)
+            self.changes[layers] = set()
+            self._index(layers)
+        elif self.changes[layers]:
+            self._patch(layers)
+        return self.views[layers]
+
+    def sections(self, prefix, layers=LAYERS):
+        """Returns the sections of the merged view of @layers having @prefix.
+
+        These are the sections named @prefix or "@prefix:<subsection>". The
+        returned Conf is shared and follows the merged view: types set on it
+        also apply to the sections added later.
+        """
+        layers = tuple(layers)
+        if (layers, prefix) not in self.sections_views:
+            conf = self.merged(layers)
+            view = Conf(conf_section_class=conf.conf_section_class)
+            view.dict = Resolver.SectionsView(self, layers, prefix)
+            self.sections_views[(layers, prefix)] = view
+        return self.sections_views[(layers, prefix)]
+
+    @staticmethod
+    def section_prefix(section_name):
+        return section_name.split(":", 1)[0]
+
+    @staticmethod
+    def index_sections(section_names):
+        """Returns @section_names grouped by prefix, in a dictionary."""
+        sections_index = {}
+        for section_name in section_names:
+            sections_index.setdefault(
+                Resolver.section_prefix(section_name), []
+            ).append(section_name)
+        return sections_index
+
+    def _index(self, layers):
+        conf = self.views[layers]
+        self.sections_indexes[layers] = Resolver.index_sections(conf)
+        # The sections of a new merged view are new, type them again
+        for ((view_layers, prefix), view) in self.sections_views.items():
+            if view_layers == layers:
+                for section_name in self.sections_indexes[layers].get(prefix, ()):
+                    view._apply_types(section_name, conf.dict[section_name])
+
+    def _index_add(self, layers, section_name):
+        prefix = Resolver.section_prefix(section_name)
+        section_names = self.sections_indexes[layers].setdefault(prefix, [])
+        if section_name not in section_names:
+            section_names.append(section_name)
+        if (layers, prefix) in self.sections_views:
+            self.sections_views[(layers, prefix)]._apply_types(
+                section_name, self.views[layers].dict[section_name]
+            )
+
+    def _index_remove(self, layers, section_name):
+        prefix = Resolver.section_prefix(section_name)
+        section_names = self.sections_indexes[layers].get(prefix, [])
+        if section_name in section_names:
+            section_names.remove(section_name)
+
+    def _changed(self, layer, section_name, key):
+        for (layers, changes) in self.changes.items():
+            if layer in layers:
+                changes.add((section_name, key))
+
+    def _layer_sections(self, layers, section_name):
+        return [
+            self.layers[layer][section_name]
+            for layer in layers
+            if layer in self.layers and section_name in self.layers[layer]
+        ]
+
+    def _merge(self, layers):
+        conf = Conf()
+        for layer in layers:
+            if layer not in self.layers:
+                continue
+            for (section_name, section) in self.layers[layer].items():
+                if section_name in conf:
+                    conf[section_name].update(section)
+                else:
+                    # Copy the section, so that the layers are never modified
+                    conf[section_name] = conf.conf_section_class(section)
+        return conf
+
+    def _patch(self, layers):
+        conf = self.views[layers]
+        changes = self.changes[layers]
+        self.changes[layers] = set()
+        sections_changed = set(
+            section_name for (section_name, key) in changes if key is None
+        )
+        for section_name in sections_changed:
+            self._patch_section(conf, layers, section_name)
+        for (section_name, key) in changes:
+            if key is None or section_name in sections_changed:
+                continue
+            if section_name not in conf:
+                self._patch_section(conf, layers, section_name)
+                sections_changed.add(section_name)
+            else:
+                self._patch_key(conf, layers, section_name, key)
+
+    def _patch_section(self, conf, layers, section_name):
+        sections = self._layer_sections(layers, section_name)
+        if not sections:
+            if section_name in conf:
+                del conf[section_name]
+                self._index_remove(layers, section_name)
+            return
+        if section_name not in conf:
+            conf[section_name] = conf.conf_section_class(sections[0])
+            for section in sections[1:]:
+                conf[section_name].update(section)
+            self._index_add(layers, section_name)
+            return
+        # Patch the existing section in place, it may be shared with plugins
+        section_merged = conf[section_name]
+        values = {}
+        for section in sections:
+            values.update(section.dict)
+        for key in [key for key in section_merged if key not in values]:
+            del section_merged[key]
+        for (key, value) in values.items():
+            if key not in section_merged or section_merged.dict[key] != value:
+                section_merged[key] = value
+
+    def _patch_key(self, conf, layers, section_name, key):
+        for section in reversed(self._layer_sections(layers, section_name)):
+            if key in section:
+                if (
+                    key not in conf[section_name]
+                    or conf[section_name].dict[key] != section.dict[key]
+                ):
+                    conf[section_name][key] = section.dict[key]
+                return
+        if key in conf[section_name]:
+            del conf[section_name][key]
@@ -0,0 +1,112 @@
+from sjconfparts.exceptions import *
+
+
+class ServiceExecutor:
+    """Restarts or reloads services through systemctl.
+
+    Services are run by waves: a service is only run once every service
+    ordered before it has been run. Each wave is run by a single systemctl
+    call. If it fails, the failing services of the wave are found with
+    "systemctl is-failed", without running the action again.
+    """
+
+    COMMAND = "systemctl"
+
+    def __init__(self, logger=None):
+        self.logger = logger
+
+    def run(self, action, services, ordering=()):
+        """Runs @action ("restart" or "reload") on @services.
+
+        @ordering is an iterable of (service, service) pairs, the first
+        service of each pair being run before the second one. Pairs
+        referring to a service that is not run are ignored.
+
+        Raises ServiceError once all the services have been run, if some of
+        them failed.
+        """
+        failures = {}
+        for wave in self.waves(services, ordering):
+            failures.update(self._run_wave(action, wave))
+        if failures:
+            raise ServiceError(action, failures)
+
+    def waves(self, services, ordering=()):
+        """Returns the services split into waves, as lists sorted by name."""
+        services = set(services)
+        predecessors = dict([(service, set()) for service in services])
+        for (service_before, service_after) in ordering:
+            if (
+                service_before in services
+                and service_after in services
+                and service_before != service_after
+            ):
+                predecessors[service_after].add(service_before)
+        waves = []
+        while predecessors:
+            wave = sorted(
+                [
+                    service
+                    for (service, services_before) in predecessors.items()
+                    if not services_before
+                ]
+            )
+            if not wave:
+                # Ordering cycle: run the remaining services together
+                wave = sorted(predecessors.keys())
+                self._logger(
+                    "Cyclic ordering between services %s, ignoring it"
+                    % (", ".join(wave))
+                )
+            for service in wave:
+                del predecessors[service]
+            for services_before in predecessors.values():
+                services_before.difference_update(wave)
+            waves.append(wave)
+        return waves
+
+    def _run_wave(self, action, services):
+        (returncode, output) = self._run_command(action, services)
+        if returncode == 0:
+            return {}
+        output = output or "exit status %d" % (returncode)
+        if len(services) == 1:
+            return {services[0]: output}
+        services_failed = self._services_failed(services)
+        if not services_failed:
+            # Failed without leaving a unit failed, e.g. a reload or an
+            # unknown unit: the error is reported for the whole wave
+            services_failed = services
+        return dict([(service, output) for service in services_failed])
+
+    def _services_failed(self, services):
+        # "systemctl is-failed" prints the state of each unit, one per line
+        (returncode, output) = self._run_command("is-failed", services, log=False)
+        states = output.splitlines()
+        if len(states) != len(services):
+            return []
+        return [
+            service
+            for (service, state) in zip(services, states)
+            if state.strip() == "failed"
+        ]
+
+    def _run_command(self, action, services, log=True):
+        import subprocess
+
+        if log:
+            self._logger("%s %s" % (action.capitalize(), " ".join(services)))
+        try:
+            process = subprocess.run(
+                [self.COMMAND, action] + list(services),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+        except OSError as exception:
+            return (-1, str(exception))
+        return (process.returncode, process.stdout.strip())
+
+    def _logger(self, str):
+        if self.logger:
+            self.logger(str)
@@ -0,0 +1,372 @@
+import abc
+import ast
+import builtins
+import hashlib
+import importlib.util
+import marshal
+import re
+import sys
+
+from sjconfparts.cache import file_write, private_dir, private_file_read
+from sjconfparts.exceptions import *
+
+
+class TemplateEngine(abc.ABC):
+    """Base class of template engines.
+
+    An engine compiles the text of a template once, and renders the compiled
+    template against a configuration mapping as many times as needed.
+    """
+
+    NAME = None
+
+    # Engines by name, see register
+    engines = {}
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+
+    @classmethod
+    def register(cls, engine_class):
+        cls.engines[engine_class.NAME] = engine_class
+        return engine_class
+
+    @classmethod
+    def engine(cls, name, cache_path=None):
+        """Returns a new engine named @name, caching on disk in @cache_path."""
+        if not name in cls.engines:
+            raise TemplateEngineNotFoundError(name)
+        return cls.engines[name](cache_path)
+
+    def compile(self, template, template_path):
+        """Returns the compiled form of @template, read from @template_path."""
+        return template
+
+    @abc.abstractmethod
+    def render(self, compiled, conf):
+        """Returns @compiled rendered against the mapping @conf."""
+
+
+@TemplateEngine.register
+class PercentTemplateEngine(TemplateEngine):
+    """Python %-formatting against the configuration mapping."""
+
+    NAME = "percent"
+
+    def render(self, compiled, conf):
+        return compiled % conf
+
+
+@TemplateEngine.register
+class CompiledTemplateEngine(TemplateEngine):
+    """Templates with substitutions, loops and conditionals.
+
+    The syntax is:
+        {{ expression }}                     the value of a Python expression
+        {% for target in expression %}       loop, up to {% endfor %}
+        {% if expression %}                  conditional, with optional
+                                             {% elif expression %} and
+                                             {% else %}, up to {% endif %}
+        {# comment #}
+
+    A {% ... %} tag alone on its line does not leave an empty line. Names
+    are the loop variables, else the keys of the configuration mapping,
+    else the Python builtins; "conf" is the configuration mapping itself.
+
+    Each template is translated to a Python function, whose code object is
+    cached on disk, in @cache_path, in one file per template path, replaced
+    when the template changes. Code objects are executed when loaded, so the
+    cache is only accessible by its owner, and a cache directory or file not
+    owned by the current user is ignored.
+    """
+
+    NAME = "compiled"
+
+    # Bumped when the generated code changes, to invalidate the disk cache
+    VERSION = 1
+
+    TOKEN_REGEXP = re.compile(
+        r"(?P<line>^[ \t]*\{%(?P<line_tag>(?:[^%]|%(?!\}))*)%\}[ \t]*(?:\n|\Z))"
+        r"|\{%(?P<tag>(?:[^%]|%(?!\}))*)%\}"
+        r"|\{\{(?P<expression>(?:[^}]|\}(?!\}))*)\}\}"
+        r"|\{#(?:[^#]|#(?!\}))*#\}",
+        re.MULTILINE,
+    )
+
+    def __init__(self, cache_path=None):
+        TemplateEngine.__init__(self, cache_path)
+        # Whether the cache directory is usable, see private_dir
+        self.cache_usable = None
+
+    def compile(self, template, template_path):
+        cache_file_path = None
+        if self.cache_path is not None and self._cache_usable():
+            cache_file_path = "%s/%s.pyc" % (
+                self.cache_path,
+                self._hash(template_path).hexdigest(),
+            )
+            # Identifies the template and the generated code in the cache file
+            source_hash = self._hash(
+                "%d\0%s\0%s" % (self.VERSION, template_path, template)
+            ).digest()
+            code = self._cache_load(cache_file_path, source_hash)
+            if code is not None:
+                return self._function(code)
+        code = compile(
+            _TemplateCompiler(template, template_path).module(),
+            template_path,
+            "exec",
+        )
+        if cache_file_path is not None:
+            self._cache_save(cache_file_path, source_hash, code)
+        return self._function(code)
+
+    def render(self, compiled, conf):
+        def lookup(name):
+            try:
+                return conf[name]
+            except KeyError:
+                pass
+            try:
+                return getattr(builtins, name)
+            except AttributeError:
+                raise NameError("name '%s' is not defined" % (name))
+
+        try:
+            return compiled(conf, lookup)
+        except Exception as exception:
+            # Reports the template line from the innermost template frame
+            traceback = sys.exc_info()[2]
+            line_number = None
+            while traceback is not None:
+                frame_code = traceback.tb_frame.f_code
+                if frame_code.co_filename == compiled.__code__.co_filename:
+                    line_number = traceback.tb_lineno
+                traceback = traceback.tb_next
+            raise TemplateError(
+                compiled.__code__.co_filename,
+                line_number,
+                "%s: %s" % (exception.__class__.__name__, exception),
+            )
+
+    def _function(self, code):
+        namespace = {}
+        exec(code, namespace)
+        return namespace["render"]
+
+    def _hash(self, text):
+        return hashlib.sha256(text.encode("utf-8", "surrogateescape"))
+
+    def _cache_usable(self):
+        if self.cache_usable is None:
+            self.cache_usable = private_dir(self.cache_path)
+        return self.cache_usable
+
+    def _cache_load(self, cache_file_path, source_hash):
+        data = private_file_read(cache_file_path)
+        if data is None:
+            return None
+        header = importlib.util.MAGIC_NUMBER + source_hash
+        if not data.startswith(header):
+            return None
+        try:
+            return marshal.loads(data[len(header) :])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def _cache_save(self, cache_file_path, source_hash, code):
+        # Replaces the code of a former version of the template
+        try:
+            file_write(
+                cache_file_path,
+                importlib.util.MAGIC_NUMBER + source_hash + marshal.dumps(code),
+                0o600,
+            )
+        except (IOError, OSError):
+            # The cache is an optimization only
+            pass
+
+
+class _TemplateCompiler:
+    # Translates a template to the module defining its render function
+
+    def __init__(self, template, template_path):
+        self.template = template
+        self.template_path = template_path
+        self.lines = []
+        # Template line of each generated line
+        self.line_numbers = []
+        self.indent = 1
+        # Open blocks, as (tag, template line, local names)
+        self.blocks = []
+
+    def module(self):
+        self._emit(0, "def render(conf, _sjconf_lookup, _sjconf_str=str):", 1)
+        self._emit(1, "_sjconf_out = []", 1)
+        self._emit(1, "_sjconf_append = _sjconf_out.append", 1)
+        position = 0
+        for match in CompiledTemplateEngine.TOKEN_REGEXP.finditer(self.template):
+            self._text(self.template[position : match.start()], position)
+            line_number = self.template.count("\n", 0, match.start()) + 1
+            if match.group("line") is not None:
+                self._tag(match.group("line_tag"), line_number)
+            elif match.group("tag") is not None:
+                self._tag(match.group("tag"), line_number)
+            elif match.group("expression") is not None:
+                self._emit(
+                    self.indent,
+                    "_sjconf_append(_sjconf_str(%s))"
+                    % (self._expression(match.group("expression"), line_number)),
+                    line_number,
+                )
+            position = match.end()
+        self._text(self.template[position:], position)
+        if self.blocks:
+            (tag, line_number, local_names) = self.blocks[-1]
+            self._error(line_number, "{%% %s %%} is not closed" % (tag))
+        self._emit(1, 'return "".join(_sjconf_out)', 1)
+        module = ast.parse("\n".join(self.lines) + "\n", self.template_path)
+        for node in ast.walk(module):
+            if "lineno" in node._attributes:
+                node.lineno = self.line_numbers[node.lineno - 1]
+                node.end_lineno = self.line_numbers[node.end_lineno - 1]
+        return module
+
+    def _text(self, text, position):
+        if text:
+            self._emit(
+                self.indent,
+                "_sjconf_append(%r)" % (text),
+                self.template.count("\n", 0, position) + 1,
+            )
+
+    def _tag(self, tag, line_number):
+        words = tag.split(None, 1)
+        keyword = words and words[0] or ""
+        argument = len(words) > 1 and words[1] or ""
+        if keyword == "for":
+            try:
+                node = ast.parse("for %s: pass" % (argument.strip())).body[0]
+            except SyntaxError:
+                self._error(line_number, "invalid tag {%% %s %%}" % (tag.strip()))
+            local_names = self._local_names()
+            iterable = self._resolve(node.iter, local_names)
+            local_names |= set(
+                [
+                    name.id
+                    for name in ast.walk(node.target)
+                    if isinstance(name, ast.Name)
+                ]
+            )
+            self._emit(
+                self.indent,
+                "for %s in %s:" % (ast.unparse(node.target), ast.unparse(iterable)),
+                line_number,
+            )
+            self._open("for", line_number, local_names)
+        elif keyword == "if":
+            self._emit(
+                self.indent,
+                "if %s:" % (self._expression(argument, line_number)),
+                line_number,
+            )
+            self._open("if", line_number, self._local_names())
+        elif keyword in ("elif", "else"):
+            if not self.blocks or self.blocks[-1][0] not in ("if", "elif"):
+                self._error(
+                    line_number, "{%% %s %%} outside of {%% if %%}" % (keyword)
+                )
+            if keyword == "elif":
+                expression = "elif %s:" % (self._expression(argument, line_number))
+            else:
+                expression = "else:"
+            self._close()
+            self._emit(self.indent, expression, line_number)
+            self._open(keyword, line_number, self._local_names())
+        elif keyword in ("endfor", "endif"):
+            opening_tags = keyword == "endfor" and ("for",) or ("if", "elif", "else")
+            if not self.blocks or self.blocks[-1][0] not in opening_tags:
+                self._error(line_number, "unexpected {%% %s %%}" % (keyword))
+            self._close()
+        else:
+            self._error(line_number, "invalid tag {%% %s %%}" % (tag.strip()))
+
+    def _open(self, tag, line_number, local_names):
+        self.blocks.append((tag, line_number, local_names))
+        self.indent += 1
+        self._emit(self.indent, "pass", line_number)
+
+    def _close(self):
+        self.blocks.pop()
+        self.indent -= 1
+
+    def _local_names(self):
+        if self.blocks:
+            return set(self.blocks[-1][2])
+        return set()
+
+    def _expression(self, expression, line_number):
+        try:
+            node = ast.parse(expression.strip(), mode="eval").body
+        except SyntaxError:
+            self._error(line_number, "invalid expression %s" % (expression.strip()))
+        return ast.unparse(self._resolve(node, self._local_names()))
+
+    def _resolve(self, node, local_names):
+        return ast.fix_missing_locations(_NameResolver(local_names).visit(node))
+
+    def _emit(self, indent, line, line_number):
+        self.lines.append("    " * indent + line)
+        self.line_numbers.append(line_number)
+
+    def _error(self, line_number, msg):
+        raise TemplateError(self.template_path, line_number, msg)
+
+
+class _NameResolver(ast.NodeTransformer):
+    # Looks up the free names of an expression in the configuration
+
+    def __init__(self, local_names):
+        self.scopes = [set(local_names) | set(["conf"])]
+
+    def visit_Name(self, node):
+        if not isinstance(node.ctx, ast.Load) or any(
+            [node.id in scope for scope in self.scopes]
+        ):
+            return node
+        return ast.copy_location(
+            ast.Call(
+                func=ast.Name(id="_sjconf_lookup", ctx=ast.Load()),
+                args=[ast.Constant(value=node.id)],
+                keywords=[],
+            ),
+            node,
+        )
+
+    def visit_Lambda(self, node):
+        self.scopes.append(
+            set([arg.arg for arg in ast.walk(node.args) if isinstance(arg, ast.arg)])
+        )
+        self.generic_visit(node)
+        self.scopes.pop()
+        return node
+
+    def _visit_comprehension(self, node):
+        scope = set()
+        for generator in node.generators:
+            scope |= set(
+                [
+                    name.id
+                    for name in ast.walk(generator.target)
+                    if isinstance(name, ast.Name)
+                ]
+            )
+        self.scopes.append(scope)
+        self.generic_visit(node)
+        self.scopes.pop()
+        return node
+
+    visit_ListComp = _visit_comprehension
+    visit_SetComp = _visit_comprehension
+    visit_DictComp = _visit_comprehension
+    visit_GeneratorExp = _visit_comprehension
@@ -1,4 +1,4 @@
-import re
+import re, functools, contextlib
 
 import sjconfparts.exceptions
 
@@ -22,6 +22,9 @@ class ConversionList:
     but no one wants nor has time to redevelop a big part of SJConf to get rid of this.
     (aka don't blame the current dev who just wants to port this mess to Python3 :-p)
 
+    Within a batch() block, the string representation is only updated once,
+    at the end of the block.
+
     Starting from Python3/new style classes, all used special methods must be
     explicitly redefined:
     https://docs.python.org/3/reference/datamodel.html#special-lookup
@@ -29,31 +32,59 @@ class ConversionList:
 
     def __add__(self, other):
         self.innerList.__add__(other)
-        self.conversion_method()
+        self._convert()
 
     def __init__(self, conversion_method, list_object=None):
         self.conversion_method = conversion_method
         if list_object == None:
             list_object = []
         self.innerList = list_object
+        self.batch_depth = 0
+        self.batch_modified = False
+
+    def _convert(self):
+        if self.batch_depth > 0:
+            self.batch_modified = True
+        else:
+            self.conversion_method()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Defer the update of the string representation to the end of the block."""
+        self.batch_begin()
+        try:
+            yield self
+        finally:
+            self.batch_end()
+
+    def batch_begin(self):
+        self.batch_depth += 1
+
+    def batch_end(self, convert=True):
+        """Ends a batch, discarding the deferred update if @convert is False."""
+        self.batch_depth -= 1
+        if self.batch_depth == 0 and self.batch_modified:
+            self.batch_modified = False
+            if convert:
+                self.conversion_method()
 
     def __contains__(self, item):
         return self.innerList.__contains__(item)
 
     def __delitem__(self, key):
         self.innerList.__delitem__(key)
-        self.conversion_method()
+        self._convert()
 
     def __getitem__(self, key):
         self.innerList.__getitem__(key)
 
     def __iadd__(self, other):
         self.innerList.__iadd__(other)
-        self.conversion_method()
+        self._convert()
 
     def __imul__(self, other):
         self.innerList.__imul__(other)
-        self.conversion_method()
+        self._convert()
 
     def __iter__(self):
         return self.innerList.__iter__()
@@ -63,19 +94,19 @@ class ConversionList:
 
     def __mul__(self, other):
         self.innerList.__mul__(other)
-        self.conversion_method()
+        self._convert()
 
     def __reversed__(self, other):
         self.innerList.__reversed__(other)
-        self.conversion_method()
+        self._convert()
 
     def __rmul__(self, other):
         self.innerList.__rmul__(other)
-        self.conversion_method()
+        self._convert()
 
     def __setitem__(self, key, value):
         self.innerList.__setitem__(key, value)
-        self.conversion_method()
+        self._convert()
 
     def __str__(self):
         return self.innerList.__str__()
@@ -94,7 +125,7 @@ class ConversionList:
                 "reverse",
                 "sort",
             ):
-                self.conversion_method()
+                self._convert()
             return result
 
         return method
@@ -161,14 +192,15 @@ class Type:
         @classmethod
         def value(cls, value, dict_str, dict_type, key):
             def conversion_method():
-                Type.List.list_to_str(dict_type, dict_str, key)
+                Type.List.list_to_str({key: list_object}, dict_str, key)
 
-            return ConversionList(conversion_method, value)
+            list_object = ConversionList(conversion_method, value)
+            return list_object
 
         @classmethod
         def str_to_list(cls, dict_source, dict_dest, key):
             def conversion_method():
-                Type.List.list_to_str(dict_dest, dict_source, key)
+                Type.List.list_to_str({key: list_object}, dict_source, key)
 
             str_object = dict_source[key]
             li = list(map(str.strip, str_object.split(",")))
@@ -176,7 +208,8 @@ class Type:
                 li.remove("")
             except ValueError:
                 pass
-            dict_dest[key] = ConversionList(conversion_method, li)
+            list_object = ConversionList(conversion_method, li)
+            dict_dest[key] = list_object
             return dict_dest
 
         @classmethod
@@ -291,7 +324,7 @@ class Type:
     class Sequence:
         @classmethod
         def key(cls, key):
-            match_results = re.compile("^(.*)-\d+$").match(key)
+            match_results = re.compile(r"^(.*)-\d+$").match(key)
             if match_results:
                 key = match_results.group(1)
             return key
@@ -300,15 +333,18 @@ class Type:
         def key_for_search(cls, key):
             if not hasattr(key, "search"):
                 key = cls.key(key)
-                key = re.compile("^%s(-\d+)?$" % (key))
+                key = re.compile(r"^%s(-\d+)?$" % (key))
             return key
 
         @classmethod
         def value(cls, value, dict_str, dict_type, key):
             def conversion_method():
-                Type.Sequence.sequence_to_str(dict_type, dict_str, key)
+                Type.Sequence.sequence_to_str(
+                    {cls.key(key): sequence_object}, dict_str, key
+                )
 
-            return ConversionList(conversion_method, value)
+            sequence_object = ConversionList(conversion_method, value)
+            return sequence_object
 
         @classmethod
         def key_to_index(cls, key, key_to_convert):
@@ -322,11 +358,13 @@ class Type:
         @classmethod
         def str_to_sequence(cls, dict_source, dict_dest, key):
             def conversion_method():
-                Type.Sequence.sequence_to_str(dict_dest, dict_source, key)
+                Type.Sequence.sequence_to_str(
+                    {key: sequence_object}, dict_source, key
+                )
 
             str_object = []
             key = cls.key(key)
-            regexp = re.compile("^%s-\d+$" % (key))
+            regexp = cls._index_regexp(key)
             for (key_to_test, value) in dict_source.items():
                 if key_to_test == key or regexp.match(key_to_test):
                     str_object.append((key_to_test, value))
@@ -341,7 +379,7 @@ class Type:
         def str_to_sequence_safe(cls, dict_source, dict_dest, key):
             str_object = []
             key = cls.key(key)
-            regexp = re.compile("^%s-\d+$" % (key))
+            regexp = cls._index_regexp(key)
             for (key_to_test, value) in dict_source.items():
                 if key_to_test == key or regexp.match(key_to_test):
                     str_object.append((key_to_test, value))
@@ -351,99 +389,100 @@ class Type:
 
         @classmethod
         def assign_elts(cls, elts, assignments_old, indices_unassigned):
-            def _assign_unassigned(
-                indices, elts_unassigned, indices_unassigned, index_prev, index
-            ):
-                indices_available = [
-                    index_unassigned
-                    for index_unassigned in indices_unassigned
-                    if index_unassigned > index_prev
-                    and (index_unassigned < index or index < -1)
-                ]
-                for index_available in indices_available:
-                    indices_unassigned.remove(index_available)
-                while len(indices_available) > len(elts_unassigned) - (
-                    index >= -1 and 1 or 0
-                ):
-                    indices_available.pop()
-                indices_available.append(index)
-                indices_to_assign = []
-                for index_available in indices_available:
-                    while len(indices_to_assign) < len(elts_unassigned) - (
-                        index_available >= -1 and 1 or 0
-                    ):
-                        if index_prev < index_available - 1 or index_available < -1:
-                            index_prev += 1
-                            indices_to_assign.append(index_prev)
-                    if index_available >= -1:
-                        indices_to_assign.append(index_available)
-                        index_prev = index_available
-                while len(elts_unassigned) > 0:
-                    elts_unassigned.pop(0)
-                    index_prev = indices_to_assign.pop(0)
-                    indices.append(index_prev)
-                return index_prev
-
-            elts_unassigned = []
+            """Returns the index to use for each element of @elts.
+
+            Elements found in @assignments_old keep their old index when the
+            elements before them fit between it and the previous index, the
+            other ones get the following free indices. Indices of
+            @indices_unassigned (keys set to an empty value) may be reused.
+            """
+            indices_unassigned = sorted(indices_unassigned)
+            position = 0
             indices = []
             index_prev = 0
+            elts_unassigned = 0
+
+            def _index_available(index):
+                # First unassigned index in ]index_prev, index[ (any index
+                # above index_prev if index is None); all the indices of the
+                # interval are consumed.
+                nonlocal position
+                while (
+                    position < len(indices_unassigned)
+                    and indices_unassigned[position] <= index_prev
+                ):
+                    position += 1
+                index_available = None
+                while position < len(indices_unassigned) and (
+                    index is None or indices_unassigned[position] < index
+                ):
+                    if index_available is None:
+                        index_available = indices_unassigned[position]
+                    position += 1
+                return index_available
+
             for elt in elts:
-                elts_unassigned.append(elt)
+                elts_unassigned += 1
                 if elt in assignments_old:
                     index = assignments_old[elt]
                     if index > index_prev and (
-                        len(elts_unassigned) == 1
-                        or len(elts_unassigned) <= index - index_prev
+                        elts_unassigned == 1 or elts_unassigned <= index - index_prev
                     ):
-                        index_prev = _assign_unassigned(
-                            indices,
-                            elts_unassigned,
-                            indices_unassigned,
-                            index_prev,
-                            index,
+                        index_available = _index_available(index)
+                        indices.extend(
+                            range(index_prev + 1, index_prev + elts_unassigned)
                         )
-            index_prev = _assign_unassigned(
-                indices, elts_unassigned, indices_unassigned, index_prev, -2
-            )
+                        if (
+                            elts_unassigned > 1
+                            and index_available is not None
+                            and index_available >= index_prev + elts_unassigned
+                        ):
+                            # The element takes the first unassigned index
+                            index = index_available
+                        indices.append(index)
+                        index_prev = index
+                        elts_unassigned = 0
+            if elts_unassigned > 0:
+                index_available = _index_available(None)
+                if (
+                    index_available is not None
+                    and index_available >= index_prev + elts_unassigned
+                ):
+                    indices.extend(range(index_prev + 1, index_prev + elts_unassigned))
+                    indices.append(index_available)
+                else:
+                    indices.extend(
+                        range(index_prev + 1, index_prev + elts_unassigned + 1)
+                    )
             return indices
 
         @classmethod
         def sequence_to_str(cls, dict_source, dict_dest, key):
             key = cls.key(key)
-            sequence_object = [elt for elt in list(dict_source[key]) if elt != ""]
-            regexp = re.compile("^%s-\d+$" % (key))
-            str_keys = [
-                key_to_test for key_to_test in dict_dest if regexp.match(key_to_test)
-            ]
-            keys_unassigned = [
-                str_key for str_key in str_keys if dict_dest[str_key] == ""
-            ]
-            str_keys = [
-                str_key for str_key in str_keys if str_key not in keys_unassigned
-            ]
+            sequence_object = [elt for elt in dict_source[key] if elt != ""]
+            regexp = cls._index_regexp(key)
+            str_keys = []
+            indices_unassigned = []
+            for (key_to_test, value) in dict_dest.items():
+                if regexp.match(key_to_test):
+                    if value == "":
+                        indices_unassigned.append(cls.key_to_index(key, key_to_test))
+                    else:
+                        str_keys.append((cls.key_to_index(key, key_to_test), key_to_test))
+            str_keys.sort(key=lambda str_key: str_key[0])
             assignments_old = dict(
-                [
-                    (dict_dest[str_key], cls.key_to_index(key, str_key))
-                    for str_key in sorted(
-                        str_keys,
-                        key=lambda key_to_convert: cls.key_to_index(
-                            key, key_to_convert
-                        ),
-                    )
-                ]
+                [(dict_dest[str_key], index) for (index, str_key) in str_keys]
             )
             indices = cls.assign_elts(
-                sequence_object,
-                assignments_old,
-                [
-                    cls.key_to_index(key, key_to_convert)
-                    for key_to_convert in keys_unassigned
-                ],
+                sequence_object, assignments_old, indices_unassigned
             )
-            for str_key in str_keys:
+            for (index, str_key) in str_keys:
                 del dict_dest[str_key]
-            while len(sequence_object) > 0:
-                elt = sequence_object.pop(0)
-                index = indices.pop(0)
+            for (elt, index) in zip(sequence_object, indices):
                 dict_dest[key + "-" + str(index)] = elt
             return dict_dest
+
+        @classmethod
+        @functools.lru_cache(maxsize=256)
+        def _index_regexp(cls, key):
+            return re.compile(r"^%s-\d+$" % (key))
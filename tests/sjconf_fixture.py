@@ -0,0 +1,96 @@
+"""Temporary SJConf tree shared by the tests, with the environment plugin."""
+
+import os
+import shutil
+import tempfile
+
+import sjconf
+
+SJCONF_CONF = """\
+[conf]
+backup_dir = %(tmpdir)s/var/backups/sjconf/
+base_dir = %(base_dir)s
+etc_dir = %(etc_dir)s
+plugins =
+plugins_path = %(plugins_path)s
+templates_path = %(tmpdir)s/etc/sjconf/templates/
+"""
+
+LOCAL_CONF = """\
+[environment]
+paths = /bin, /usr/bin
+"""
+
+BASE_CONF = """\
+[environment]
+paths =
+"""
+
+ENVIRONMENT_PLUGIN = """\
+import sjconf
+
+class Plugin(sjconf.Plugin):
+
+    VERSION = '6.6.6'
+
+    class Error(sjconf.Plugin.Error):
+        pass
+
+    def conf_types(self):
+        return (
+            (self.name(), 'paths', 'list'),
+        )
+
+    def file_content(self, file_path):
+        content  = ''
+        content += "PATH=\\"" + ':'.join(self.conf[self.name()]['paths_list']) + "\\"\\n"
+        return content
+
+    def conf_files_path(self):
+        return (self.sjconf.etc_dir + '/environment',)
+"""
+
+
+
+class SJConfFixture:
+    """Mixin of test cases running on a temporary SJConf tree.
+
+    The tree has a base.conf, a local.conf and the environment plugin,
+    enabled, and self.conf is the SJConf object using it.
+    """
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix="sjconftest_")
+        self._etc = self._tmpdir + "/etc"
+        self._sjconf = self._tmpdir + "/etc/sjconf"
+        self._sjconf_conf = self._tmpdir + "/etc/sjconf/sjconf.conf"
+        self._base_conf = self._tmpdir + "/etc/sjconf/base.conf"
+        self._local_conf = self._tmpdir + "/etc/sjconf/local.conf"
+        self._plugins = self._tmpdir + "/var/lib/sjconf/plugins"
+        self._environment = self._tmpdir + "/var/lib/sjconf/plugins/environment.py"
+
+        os.makedirs(self._sjconf)
+        with open(self._base_conf, "w") as f:
+            f.write(BASE_CONF)
+        with open(self._local_conf, "w") as f:
+            f.write(LOCAL_CONF)
+        with open(self._sjconf_conf, "w") as f:
+            f.write(
+                SJCONF_CONF
+                % {
+                    "tmpdir": self._tmpdir,
+                    "etc_dir": self._etc,
+                    "base_dir": self._sjconf,
+                    "plugins_path": self._plugins,
+                }
+            )
+
+        os.makedirs(self._plugins)
+        with open(self._environment, "w") as f:
+            f.write(ENVIRONMENT_PLUGIN)
+
+        self.conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        self.conf.plugin_enable("environment")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
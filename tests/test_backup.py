@@ -0,0 +1,277 @@
+#!/usr/bin/nosetests3
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import sjconf
+from sjconf_fixture import SJConfFixture
+from sjconfparts.backup import BackupStore
+from sjconfparts.exceptions import *
+
+
+class TestBackupStore(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix="sjconftest_")
+        self._file = self._tmpdir + "/file.conf"
+        with open(self._file, "w") as f:
+            f.write("key = value\n" * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_01_compression(self):
+        for compression in ("none", "gz", "gz:1", "xz"):
+            store = BackupStore(self._tmpdir + "/" + compression, compression)
+            hash = store.store(self._file)
+            self.assertEqual(store.store(self._file), hash)
+            store.archive([hash])
+            self.assertTrue(os.path.exists(store.object_path(hash, store.compression)))
+            store.restore(hash, 0o640, self._tmpdir + "/restored")
+            with open(self._tmpdir + "/restored") as f:
+                self.assertEqual(f.read(), "key = value\n" * 100)
+            mode = os.stat(self._tmpdir + "/restored").st_mode
+            self.assertEqual(mode & 0o777, 0o640)
+
+    def test_02_link(self):
+        store = BackupStore(self._tmpdir + "/store")
+        hash = store.store(self._file, link=True)
+        inode = os.stat(self._file).st_ino
+        self.assertEqual(os.stat(store.object_path(hash)).st_ino, inode)
+        # Modifying a hard linked file in place corrupts its object
+        with open(self._file, "a") as f:
+            f.write("modified")
+        with self.assertRaises(BackupCorruptedError):
+            store.restore(hash, None, self._tmpdir + "/restored")
+        self.assertFalse(os.path.exists(self._tmpdir + "/restored.sjconf"))
+        hash = store.store(self._file)
+        self.assertNotEqual(os.stat(store.object_path(hash)).st_ino, inode)
+
+    def test_03_invalid_compression(self):
+        for compression in ("bz2", "gz:fast"):
+            with self.assertRaises(BackupCompressionError):
+                BackupStore(self._tmpdir, compression)
+
+    def test_04_select_pruned(self):
+        day = 24 * 3600
+        now = time.mktime((2024, 6, 14, 12, 0, 0, 0, 0, -1))  # A Friday
+        backups = [
+            {"id": str(i), "time": now - delay, "hashes": {str(i): 10}}
+            for (i, delay) in enumerate(
+                (20 * day, 9 * day, 2 * day, day + 60, day, 3600, 60)
+            )
+        ]
+
+        def kept(**kw):
+            pruned = BackupStore.select_pruned(backups, **kw)
+            return [backup["id"] for backup in backups if backup not in pruned]
+
+        self.assertEqual(kept(), ["0", "1", "2", "3", "4", "5", "6"])
+        self.assertEqual(kept(keep_last=2), ["5", "6"])
+        self.assertEqual(kept(keep_daily=3), ["2", "4", "6"])
+        self.assertEqual(kept(keep_weekly=2), ["1", "6"])
+        self.assertEqual(kept(keep_last=1, keep_weekly=3), ["0", "1", "6"])
+        self.assertEqual(kept(max_size=25), ["5", "6"])
+        self.assertEqual(kept(keep_daily=3, max_size=5), ["6"])
+        # Objects of deleted backups are counted again for older backups
+        backups = [
+            {"id": str(i), "time": now - 60 * (4 - i), "hashes": hashes}
+            for (i, hashes) in enumerate(
+                ({"b": 10}, {"a": 10}, {"b": 10}, {"a": 10, "c": 1})
+            )
+        ]
+        self.assertEqual(kept(max_size=15), ["1", "3"])
+
+    def test_05_prune(self):
+        store = BackupStore(self._tmpdir + "/store")
+        # Tarball of a former version
+        os.makedirs(store.path)
+        archive_path = store.path + "/sjconf_backup_2020-01-01-00:00:00.tgz"
+        with open(archive_path, "w"):
+            pass
+        os.utime(archive_path, (1577836800, 1577836800))
+        hash_old = store.store(self._file)
+        store.save_manifest("old", [self.manifest_file(hash_old)])
+        with open(self._file, "w") as f:
+            f.write("key = new value\n")
+        hash_new = store.store(self._file)
+        store.save_manifest("new", [self.manifest_file(hash_new)])
+        self.assertEqual(
+            [backup["id"] for backup in BackupStore(store.path).backups()],
+            ["2020-01-01-00:00:00", "old", "new"],
+        )
+        self.assertEqual(store.prune(keep_last=1), ["2020-01-01-00:00:00", "old"])
+        self.assertFalse(os.path.exists(archive_path))
+        self.assertEqual(os.listdir(store.path + "/manifests"), ["new.json"])
+        self.assertFalse(os.path.exists(store.object_path(hash_old)))
+        self.assertTrue(os.path.exists(store.object_path(hash_new)))
+        self.assertEqual(
+            [backup["id"] for backup in BackupStore(store.path).backups()], ["new"]
+        )
+
+    @unittest.skipUnless(os.geteuid() == 0, "requires root")
+    def test_06_owner(self):
+        store = BackupStore(self._tmpdir + "/store")
+        hash = store.store(self._file)
+        restored = self._tmpdir + "/restored"
+        store.restore(hash, 0o640, restored, (1234, 4321))
+        stat = os.stat(restored)
+        self.assertEqual((stat.st_uid, stat.st_gid), (1234, 4321))
+        manifest_file = dict(self.manifest_file(hash), path=restored, uid=0, gid=0)
+        store.restore_files([manifest_file])
+        stat = os.stat(restored)
+        self.assertEqual(
+            (stat.st_uid, stat.st_gid, stat.st_mode & 0o777), (0, 0, 0o644)
+        )
+
+    def test_07_concurrent_stores(self):
+        store = BackupStore(self._tmpdir + "/store")
+        other_store = BackupStore(store.path)
+        self.assertEqual(store.backups(), [])
+        hash_other = other_store.store(self._file)
+        other_store.save_manifest("other", [self.manifest_file(hash_other)])
+        # The stale index of store is reloaded before being written
+        store.save_manifest("new", [self.manifest_file(None)])
+        self.assertEqual(
+            sorted([backup["id"] for backup in BackupStore(store.path).backups()]),
+            ["new", "other"],
+        )
+        # Objects referenced by a manifest survive an outdated index
+        with open(store.path + "/index.json") as f:
+            index = json.load(f)
+        del index["backups"]["other"]
+        with open(store.path + "/index.json", "w") as f:
+            json.dump(index, f)
+        store.save_manifest("newest", [self.manifest_file(None)])
+        self.assertEqual(store.prune(keep_last=1), ["new"])
+        self.assertTrue(os.path.exists(store.object_path(hash_other)))
+
+    def test_08_archive_collected(self):
+        store = BackupStore(self._tmpdir + "/store", "gz")
+        hash = store.store(self._file)
+        open_compressed = store._open_compressed
+
+        def collected(*args):
+            # As a prune, from another process, while compressing
+            os.unlink(store.object_path(hash))
+            return open_compressed(*args)
+
+        store._open_compressed = collected
+        store.archive([hash])
+        self.assertEqual(os.listdir(os.path.dirname(store.object_path(hash))), [])
+
+    def manifest_file(self, hash):
+        return {"path": self._file, "plugin": "plugin", "hash": hash, "mode": 0o644}
+
+
+class TestBackup(SJConfFixture, unittest.TestCase):
+    def test_01_backup_restore(self):
+        environment_path = self.conf.etc_dir + "/environment"
+        self.conf.deploy_conf()
+        manifest = self.conf.backup_store.manifest(self.conf.backup_id)
+        assert [(f["plugin"], f["hash"]) for f in manifest["files"]][1:] == [
+            ("environment", None)
+        ]
+
+        self.conf.set("environment", "paths", "/sbin")
+        self.conf.apply_conf_modifications()
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        deployed = []
+
+        def restart_services(plugins, reload=False):
+            with open(environment_path, "r") as fi:
+                deployed.append(fi.read(4096))
+            raise sjconf.ServiceError("restart", {"environment": "failed"})
+
+        conf.restart_services = restart_services
+        with self.assertRaises(sjconf.ServiceError):
+            conf.deploy_conf(services_to_restart=["environment"])
+        assert deployed[0] == 'PATH="/sbin"\n'
+        with open(environment_path, "r") as fi:
+            assert fi.read(4096) == 'PATH="/bin:/usr/bin"\n'
+        assert not os.path.exists(conf.backup_store.manifest_path(conf.backup_id))
+
+
+    def test_02_rollback(self):
+        environment_path = self.conf.etc_dir + "/environment"
+        self.conf.deploy_conf()
+        backup_id_first = self.conf.backup_id
+        self.conf.set("environment", "paths", "/sbin")
+        self.conf.apply_conf_modifications()
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        conf.deploy_conf()
+        with open(environment_path, "r") as fi:
+            assert fi.read(4096) == 'PATH="/sbin"\n'
+
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        restarted = []
+        conf.restart_services = lambda plugins, reload=False: restarted.append(
+            list(plugins)
+        )
+        files_restored = conf.rollback()
+        assert sorted([f["plugin"] for f in files_restored]) == [
+            "environment",
+            "sjconf",
+        ]
+        assert restarted == [["environment"]]
+        with open(environment_path, "r") as fi:
+            assert fi.read(4096) == 'PATH="/bin:/usr/bin"\n'
+        assert conf.conf_local()["environment"]["paths"] == "/bin, /usr/bin"
+        # Rolling back again restores the files as they were before the rollback
+        assert len(conf.backup_store.backups()) == 3
+        conf.rollback()
+        with open(environment_path, "r") as fi:
+            assert fi.read(4096) == 'PATH="/sbin"\n'
+
+        conf.rollback(backup_id_first)
+        assert not os.path.exists(environment_path)
+        with self.assertRaises(sjconf.BackupNotFoundError):
+            conf.rollback("unknown")
+
+    def test_03_retention_error(self):
+        with open(self._sjconf_conf) as f:
+            sjconf_conf = f.read()
+        for (key, value) in (("backup_keep_last", "two"), ("backup_max_size", "1X")):
+            with open(self._sjconf_conf, "w") as f:
+                f.write(sjconf_conf + "%s = %s\n" % (key, value))
+            # Only the commands deploying or pruning use the retention policy
+            conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+            assert conf.conf()["environment"]["paths"] == "/bin, /usr/bin"
+            with self.assertRaises(sjconf.BackupRetentionError) as context:
+                conf.deploy_conf()
+            assert key in str(context.exception)
+            assert not os.path.exists(conf.etc_dir + "/environment")
+            with self.assertRaises(sjconf.BackupRetentionError):
+                conf.prune_backups()
+        with open(self._sjconf_conf, "w") as f:
+            f.write(sjconf_conf + "backup_keep_last = 1\nbackup_max_size = 1M\n")
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        conf.deploy_conf()
+        assert conf.backup_retention == {"keep_last": 1, "max_size": 1024 * 1024}
+    def test_04_rollback_archive_prune(self):
+        with open(self._sjconf_conf, "a") as f:
+            f.write("backup_compression = gz\nbackup_keep_last = 2\n")
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        conf.deploy_conf()
+        conf.set("environment", "paths", "/sbin")
+        conf.apply_conf_modifications()
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        conf.deploy_conf()
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        conf.restart_services = lambda plugins, reload=False: None
+        conf.rollback()
+        # The backup of the rollback is compressed, and the oldest one pruned
+        self.assertEqual(len(conf.backup_store.backups()), 2)
+        manifest = conf.backup_store.manifest(conf.backup_id)
+        hashes = [f["hash"] for f in manifest["files"] if f["hash"] is not None]
+        self.assertTrue(hashes)
+        for hash in hashes:
+            self.assertTrue(os.path.exists(conf.backup_store.object_path(hash, "gz")))
+            self.assertFalse(os.path.exists(conf.backup_store.object_path(hash)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/nosetests3
+
+import unittest
+
+import sjconf
+from sjconf_fixture import LOCAL_CONF, SJConfFixture
+
+
+class TestBatch(SJConfFixture, unittest.TestCase):
+    def test_01_batch(self):
+        stream = [
+            '{"op": "add-to-list", "section": "environment", "key": "paths", "value": "/sbin"}\n',
+            "\n",
+            '{"op": "list_remove", "section": "environment", "key": "paths", "value": "/bin"}\n',
+            '{"op": "set", "section": "other", "key": "key", "value": "value"}\n',
+        ]
+        self.conf.apply_conf_modifications(stream=stream)
+        with open(self._local_conf, "r") as fi:
+            local_conf = fi.read(4096)
+        assert "paths = /usr/bin, /sbin" in local_conf
+        assert "[other]" in local_conf
+
+    def test_02_batch_error(self):
+        stream = [
+            '{"op": "set", "section": "environment", "key": "paths", "value": "/sbin"}\n',
+            '{"op": "set", "section": "environment", "key": "paths"}\n',
+        ]
+        with self.assertRaises(sjconf.BatchError) as context:
+            self.conf.apply_conf_modifications(stream=stream)
+        assert context.exception.line_number == 2
+        with open(self._local_conf, "r") as fi:
+            assert fi.read(4096) == LOCAL_CONF
+
+    def test_03_batch_value_error(self):
+        stream = [
+            '{"op": "set", "section": "environment", "key": "paths", "value": "/sbin"}\n',
+            '{"op": "remove-from-list", "section": "environment", "key": "paths", "value": "/bin"}\n',
+        ]
+        with self.assertRaises(sjconf.BatchError) as context:
+            self.conf.apply_conf_modifications(stream=stream)
+        assert context.exception.line_number == 2
+        assert '"remove-from-list"' in str(context.exception)
+        with open(self._local_conf, "r") as fi:
+            assert fi.read(4096) == LOCAL_CONF
+
+    def test_04_batch_key_error(self):
+        stream = [
+            '{"op": "remove-from-list", "section": "other", "key": "paths", "value": "/bin"}\n',
+        ]
+        with self.assertRaises(sjconf.BatchError) as context:
+            self.conf.apply_conf_modifications(stream=stream)
+        assert context.exception.line_number == 1
+        assert "'other'" in str(context.exception)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/nosetests3
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import sjconf
+
+from sjconfparts.cache import ParseCache
+from sjconfparts.conf import Conf
+
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix="sjconftest_")
+        self._cache = self._tmpdir + "/conf_cache"
+        self._confs = [self._tmpdir + "/%s.conf" % (name) for name in ("a", "b")]
+        for conf_path in self._confs:
+            with open(conf_path, "w") as f:
+                f.write("[section]\nkey = secret\n")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def _entries(self):
+        return sorted(os.listdir(self._cache))
+
+    def test_01_save(self):
+        cache = ParseCache(self._cache)
+        for conf_path in self._confs:
+            Conf(file_path=conf_path, cache=cache)
+        # Saved by the caller
+        self.assertEqual(self._entries(), [])
+        cache.save()
+        self.assertEqual(stat.S_IMODE(os.stat(self._cache).st_mode), 0o700)
+        self.assertEqual(len(self._entries()), 2)
+        for entry in self._entries():
+            entry_stat = os.stat(self._cache + "/" + entry)
+            self.assertEqual(stat.S_IMODE(entry_stat.st_mode), 0o600)
+        cache = ParseCache(self._cache)
+        stat_key = cache.stat_key(self._confs[0])
+        self.assertEqual(
+            cache.get(self._confs[0], "magic", stat_key),
+            [["section", [["key", "secret"]]]],
+        )
+
+    def test_02_deleted_files(self):
+        cache = ParseCache(self._cache)
+        for conf_path in self._confs:
+            Conf(file_path=conf_path, cache=cache)
+        cache.save()
+        os.unlink(self._confs[1])
+        with open(self._confs[0], "a") as f:
+            f.write("other = value\n")
+        cache = ParseCache(self._cache)
+        Conf(file_path=self._confs[0], cache=cache)
+        cache.save()
+        cache.drop_deleted()
+        entry_path = cache._entry_path(self._confs[0], "magic")
+        self.assertEqual(self._entries(), [os.path.basename(entry_path)])
+
+    def test_03_not_owned(self):
+        cache = ParseCache(self._cache)
+        Conf(file_path=self._confs[0], cache=cache)
+        cache.save()
+        stat_key = cache.stat_key(self._confs[0])
+        entry_path = cache._entry_path(self._confs[0], "magic")
+        os.chown(entry_path, 1, 1)
+        self.assertIsNone(
+            ParseCache(self._cache).get(self._confs[0], "magic", stat_key)
+        )
+        os.chown(entry_path, os.geteuid(), os.getegid())
+        os.chmod(self._cache, 0o755)
+        self.assertIsNotNone(
+            ParseCache(self._cache).get(self._confs[0], "magic", stat_key)
+        )
+        self.assertEqual(stat.S_IMODE(os.stat(self._cache).st_mode), 0o700)
+        os.chown(self._cache, 1, 1)
+        self.assertIsNone(
+            ParseCache(self._cache).get(self._confs[0], "magic", stat_key)
+        )
+
+    def test_04_conf_local(self):
+        sjconf_conf = self._tmpdir + "/sjconf.conf"
+        with open(sjconf_conf, "w") as f:
+            f.write(
+                "[conf]\n"
+                + "".join(
+                    "%s = %s\n" % (key, self._tmpdir)
+                    for key in (
+                        "backup_dir",
+                        "base_dir",
+                        "etc_dir",
+                        "internal_config_path",
+                        "plugins_path",
+                        "templates_path",
+                    )
+                )
+                + "plugins =\n"
+            )
+        with open(self._tmpdir + "/local.conf", "w") as f:
+            f.write("[section]\nkey = value\n")
+        # As --get, which only loads local.conf
+        sjconf.SJConf(sjconf_file_path=sjconf_conf).conf_local()
+        cache = ParseCache(self._cache)
+        entry_path = cache._entry_path(self._tmpdir + "/local.conf", "raw")
+        self.assertEqual(self._entries(), [os.path.basename(entry_path)])
+
+if __name__ == "__main__":
+    unittest.main()
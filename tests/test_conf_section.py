@@ -0,0 +1,124 @@
+#!/usr/bin/nosetests3
+
+import re
+import unittest
+
+from sjconfparts.conf import Conf
+
+
+class TestTypeIndex(unittest.TestCase):
+    def setUp(self):
+        self.section = Conf.ConfSection(
+            {
+                "paths": "/bin, /usr/bin",
+                "path_max": "yes",
+                "server-1": "a",
+                "server-2": "b",
+                "shell": "sh, bash",
+            }
+        )
+
+    def test_01_exact_before_pattern(self):
+        self.section.set_type(re.compile("^path"), "bool")
+        self.section.set_type("paths", "list")
+        self.assertEqual(self.section._find_type_for("paths"), "list")
+        self.assertEqual(self.section._find_type_for("path_max"), "bool")
+        self.assertEqual(list(self.section["paths_list"]), ["/bin", "/usr/bin"])
+        self.assertTrue(self.section["path_max_bool"])
+        # Whatever the order they were set in
+        section = Conf.ConfSection(self.section.dict)
+        section.set_type("paths", "list")
+        section.set_type(re.compile("^path"), "bool")
+        self.assertEqual(section._find_type_for("paths"), "list")
+        self.assertEqual(section._find_type_for("path_max"), "bool")
+
+    def test_02_pattern_order(self):
+        self.section.set_type(re.compile("^serv"), "list")
+        self.section.set_type("server", "sequence")
+        self.assertEqual(self.section.type_patterns, [re.compile("^serv")])
+        self.assertEqual(list(self.section.sequence_types), ["server"])
+        # The first set pattern wins
+        self.assertEqual(self.section._find_type_for("server-1"), "list")
+        section = Conf.ConfSection(self.section.dict)
+        section.set_type("server", "sequence")
+        section.set_type(re.compile("^serv"), "list")
+        self.assertEqual(section._find_type_for("server-1"), "sequence")
+        self.assertEqual(section._find_type_for("servers"), "list")
+
+    def test_03_del_type(self):
+        self.section.set_type(re.compile("^path"), "bool")
+        self.section.set_type("paths", "list")
+        self.section.set_type("server", "sequence")
+        self.assertEqual(self.section._find_type_for("paths"), "list")
+        self.assertEqual(self.section._find_type_for("server-2"), "sequence")
+        self.section.del_type("paths")
+        self.section.del_type("server", "sequence")
+        self.assertEqual(self.section._find_type_for("paths"), "bool")
+        self.assertEqual(self.section._find_type_for("server-2"), None)
+        self.assertEqual(self.section.sequence_types, {})
+        self.assertEqual(list(self.section.type_positions), [re.compile("^path")])
+
+    def test_04_cache_invalidation(self):
+        self.assertEqual(self.section._find_type_for("shell"), None)
+        self.assertEqual(self.section.type_cache, {"shell": None})
+        self.section.set_type("shell", "list")
+        self.assertEqual(self.section._find_type_for("shell"), "list")
+        self.assertEqual(list(self.section["shell_list"]), ["sh", "bash"])
+        self.assertEqual(self.section._find_type_for("sh_options"), None)
+        self.section.set_type(re.compile("^sh"), "bool")
+        self.assertEqual(self.section._find_type_for("sh_options"), "bool")
+        # The exact type still wins over the new pattern
+        self.assertEqual(self.section._find_type_for("shell"), "list")
+
+
+class TestTypedValues(unittest.TestCase):
+    def setUp(self):
+        self.section = Conf.ConfSection({"paths": "/bin"})
+        self.section.set_type("paths", "list")
+        self.calls = []
+
+    def _count_batch_calls(self, list_object):
+        def batch_begin(batch_begin=list_object.batch_begin):
+            self.calls.append("batch_begin")
+            batch_begin()
+
+        def batch_end(convert=True, batch_end=list_object.batch_end):
+            self.calls.append("batch_end")
+            batch_end(convert)
+
+        list_object.batch_begin = batch_begin
+        list_object.batch_end = batch_end
+
+    def test_01_lazy(self):
+        # Only converted on first access
+        self.assertEqual(self.section.type_values, {})
+        self.assertEqual(list(self.section["paths_list"]), ["/bin"])
+        self.assertEqual(list(self.section.type_values), ["paths"])
+        self.section["paths"] = "/sbin, /usr/sbin"
+        self.assertEqual(self.section.type_values, {})
+        self.assertEqual(list(self.section["paths_list"]), ["/sbin", "/usr/sbin"])
+
+    def test_02_batch(self):
+        self._count_batch_calls(self.section["paths_list"])
+        with self.section.batch():
+            self.section["paths_list"].append("/sbin")
+            with self.section.batch():
+                self.section["paths_list"].append("/usr/sbin")
+            # The string value is only updated at the end of the outer block
+            self.assertEqual(self.section["paths"], "/bin")
+        self.assertEqual(self.calls, ["batch_begin", "batch_end"])
+        self.assertEqual(self.section["paths"], "/bin, /sbin, /usr/sbin")
+
+    def test_03_batch_exception(self):
+        self._count_batch_calls(self.section["paths_list"])
+        with self.assertRaises(ValueError):
+            with self.section.batch():
+                self.section["paths_list"].append("/sbin")
+                raise ValueError()
+        self.assertEqual(self.calls, ["batch_begin", "batch_end"])
+        self.assertEqual(self.section["paths"], "/bin, /sbin")
+        self.assertEqual(self.section.batch_lists, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
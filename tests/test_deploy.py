@@ -0,0 +1,77 @@
+#!/usr/bin/nosetests3
+
+import os
+import threading
+import unittest
+
+import sjconf
+from sjconf_fixture import ENVIRONMENT_PLUGIN, SJConfFixture
+
+
+class TestDeploy(SJConfFixture, unittest.TestCase):
+    def test_01_deploy_unchanged(self):
+        environment_path = self.conf.etc_dir + "/environment"
+        conf_files_changed = self.conf.deploy_conf(backup=False)
+        self.assertEqual(
+            [conf_file.path for conf_file in conf_files_changed], [environment_path]
+        )
+        inode = os.stat(environment_path).st_ino
+        self.assertEqual(self.conf.deploy_conf(backup=False), [])
+        self.assertEqual(os.stat(environment_path).st_ino, inode)
+
+    def test_02_deploy_restart_changed(self):
+        restarted = []
+        self.conf.restart_services = lambda plugins, reload=False: restarted.append(
+            list(plugins)
+        )
+        self.conf.deploy_conf(backup=False, restart_changed=True)
+        self.assertEqual(restarted, [["environment"]])
+        self.conf.deploy_conf(backup=False, restart_changed=True)
+        self.assertEqual(restarted, [["environment"]])
+
+    def test_03_deploy_jobs(self):
+        # A second plugin, rendered concurrently with environment
+        with open(self._plugins + "/shell.py", "w") as f:
+            f.write(ENVIRONMENT_PLUGIN.replace("/environment", "/shell"))
+        with open(self._local_conf, "a") as f:
+            f.write("[shell]\npaths = /opt/bin\n")
+        self.conf.plugin_enable("shell")
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        # Each plugin waits for the other one: rendering is done in parallel
+        barrier = threading.Barrier(2, timeout=5)
+
+        def waiting(file_content):
+            def file_content_waiting(file_path):
+                barrier.wait()
+                return file_content(file_path)
+
+            return file_content_waiting
+
+        plugins = conf.plugins()
+        for plugin in plugins.values():
+            plugin.file_content = waiting(plugin.file_content)
+        conf_files_changed = conf.deploy_conf(backup=False, jobs=2)
+        self.assertEqual(
+            sorted([conf_file.path for conf_file in conf_files_changed]),
+            [conf.etc_dir + "/environment", conf.etc_dir + "/shell"],
+        )
+        with open(conf.etc_dir + "/environment", "r") as fi:
+            self.assertEqual(fi.read(4096), 'PATH="/bin:/usr/bin"\n')
+        with open(conf.etc_dir + "/shell", "r") as fi:
+            self.assertEqual(fi.read(4096), 'PATH="/opt/bin"\n')
+
+        # A rendering error is raised once every plugin is done, and nothing
+        # is written
+        def file_content(file_path):
+            barrier.wait()
+            raise ValueError(file_path)
+
+        plugins["shell"].file_content = file_content
+        os.unlink(conf.etc_dir + "/environment")
+        with self.assertRaises(ValueError):
+            conf.deploy_conf(backup=False, jobs=2)
+        self.assertFalse(os.path.exists(conf.etc_dir + "/environment"))
+
+
+if __name__ == "__main__":
+    unittest.main()
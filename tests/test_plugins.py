@@ -6,7 +6,8 @@ import tempfile
 import unittest
 
 import sjconf
-from sjconfparts.plugin import Plugin
+from sjconfparts.dependency import PluginGraph, debian_version_compare
+from sjconfparts.plugin import Plugin, PluginInfo, PluginWithTemplate
 
 SJCONF_CONF = """\
 [conf]
@@ -16,6 +17,7 @@ etc_dir = %(etc_dir)s
 plugins =
 plugins_path = %(plugins_path)s
 templates_path = %(tmpdir)s/etc/sjconf/templates/
+internal_config_path = %(tmpdir)s/var/lib/sjconf/
 """
 
 LOCAL_CONF = """\
@@ -113,6 +115,121 @@ class TestPlugin(unittest.TestCase):
         self.assertRaises(Plugin.Dependency.BadVersionError, dep.verify, "0.9.2")
         self.assertRaises(Plugin.Dependency.BadVersionError, dep.verify, "0.9.1+bpo")
 
+    def test_06_template_cache(self):
+        template_path = self._sjconf + "/plugin.tmpl"
+        with open(template_path, "w") as f:
+            f.write("paths = %(paths)s\n")
+        template = PluginWithTemplate.template(template_path)
+        self.assertEqual(template, "paths = %(paths)s\n")
+        self.assertIs(PluginWithTemplate.template(template_path), template)
+        with open(template_path, "w") as f:
+            f.write("PATH=%(paths)s\n")
+        self.assertEqual(PluginWithTemplate.template(template_path), "PATH=%(paths)s\n")
+
+    def test_07_plugin_manifest(self):
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        plugin_info = conf.plugins_infos()["plugin"]
+        self.assertEqual(plugin_info["plugin"].version(), "0.42.0")
+        self.assertTrue(plugin_info["is_enabled"])
+        self.assertEqual(
+            plugin_info["plugin"].conf_files_path(), (self._etc + "/plugin",)
+        )
+
+        # Listed from the manifest, without importing the plugin
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        conf._plugins_init = None
+        self.assertEqual(conf.plugins_infos()["plugin"]["plugin"].version(), "0.42.0")
+
+        with open(self._plugin, "w") as f:
+            f.write(PLUGIN.replace("0.42.0", "0.43.0~rc1"))
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        self.assertEqual(
+            conf.plugins_infos()["plugin"]["plugin"].version(), "0.43.0~rc1"
+        )
+        conf.file_uninstall("plugin", "plugin")
+        self.assertEqual(conf.plugin_manifest.entries, {})
+        with open(self._tmpdir + "/plugin.py", "w") as f:
+            f.write(PLUGIN)
+        conf.file_install("plugin", self._tmpdir + "/plugin.py")
+        self.assertEqual(
+            conf.plugin_manifest.entries["plugin"]["plugin"]["version"], "0.42.0"
+        )
+
+        # Configuration dependent methods are not recorded, nor called to list
+        with open(self._plugins + "/vhost.py", "w") as f:
+            f.write(
+                PLUGIN.replace(
+                    "(self.sjconf.etc_dir + '/plugin',)",
+                    "(self.conf[self.name()]['path'],)",
+                )
+            )
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        plugin_info = conf.plugins_infos()["vhost"]
+        self.assertEqual(plugin_info["plugin"].version(), "0.42.0")
+        self.assertEqual(
+            sorted(conf.plugin_manifest.entries["vhost"]["plugin"]),
+            ["dependencies", "name", "version"],
+        )
+        with self.assertRaises(KeyError):
+            plugin_info["plugin"].conf_files_path()
+
+        with open(self._tmpdir + "/broken.py", "w") as f:
+            f.write("raise ImportError('broken')\n")
+        with self.assertRaises(Plugin.LoadError):
+            conf.file_install("plugin", self._tmpdir + "/broken.py")
+        self.assertFalse(os.path.exists(self._plugins + "/broken.py"))
+
+    def test_08_debian_version_compare(self):
+        for (version_a, version_b) in (
+            ("0.9.1", "0.42.11"),
+            ("0.9.1~dev", "0.9.1"),
+            ("0.9.1", "0.9.1+bpo"),
+            ("1.0~rc1", "1.0~rc1+b1"),
+            ("1.0~~", "1.0~"),
+            ("1.0-1", "1.0-2"),
+            ("1.0-9", "1.0-10"),
+            ("1.0a", "1.0+"),
+            ("9.9", "1:0.1"),
+            ("1.0", "1.0.0"),
+        ):
+            self.assertTrue(debian_version_compare(version_a, version_b) < 0)
+            self.assertTrue(debian_version_compare(version_b, version_a) > 0)
+        for (version_a, version_b) in (
+            ("1.0", "1.00"),
+            ("1.0", "0:1.0"),
+            ("1-0", "1"),
+        ):
+            self.assertEqual(debian_version_compare(version_a, version_b), 0)
+
+    def test_09_plugins_graph(self):
+        def plugin(name, *dependencies):
+            return PluginInfo(
+                {
+                    "name": name,
+                    "version": "1.0",
+                    "dependencies": [
+                        {"name": dependency, "optional": False, "requirements": {}}
+                        for dependency in dependencies
+                    ],
+                }
+            )
+
+        plugins = [
+            plugin("web", "php", "tls"),
+            plugin("php"),
+            plugin("tls", "php"),
+            plugin("a", "b"),
+            plugin("b", "a"),
+            plugin("c", "b", "missing"),
+        ]
+        plugin_names = [plugin.name() for plugin in plugins]
+        graph = PluginGraph(plugins, plugin_names, plugin_names + ["missing"])
+        self.assertEqual(graph.order(), ["php", "tls", "web", "a", "b", "c"])
+        self.assertEqual(graph.cycles, [["a", "b"]])
+        self.assertEqual(sorted(graph.dependencies(plugins[0])), ["php", "tls"])
+        with self.assertRaises(Plugin.Dependency.NotEnabledError):
+            graph.dependencies(plugins[5])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,33 @@
+#!/usr/bin/nosetests3
+
+import os
+import unittest
+
+import sjconf
+from sjconf_fixture import SJConfFixture
+
+
+class TestProfiles(SJConfFixture, unittest.TestCase):
+    def test_01_profile_conflict(self):
+        os.makedirs(self._sjconf + "/profiles")
+        for (profile, shell) in (("p1", "bash"), ("p2", "zsh"), ("p3", "sh")):
+            with open(self._sjconf + "/profiles/%s.conf" % (profile), "w") as f:
+                f.write("[environment]\nshell = %s\nterm = xterm\n" % (shell))
+        with open(self._local_conf, "a") as f:
+            f.write("[sjconf]\nprofiles-1 = p1, p2\n")
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        with self.assertRaises(sjconf.Conf.ProfileConflictError) as context:
+            conf.conf()
+        assert '"p2" and "p1"' in str(context.exception)
+        assert 'key "shell"' in str(context.exception)
+
+        # Overridden by a higher level
+        with open(self._local_conf, "a") as f:
+            f.write("profiles-2 = p3\n")
+        conf = sjconf.SJConf(sjconf_file_path=self._sjconf_conf)
+        assert conf.conf()["environment"]["shell"] == "sh"
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/nosetests3
+
+import unittest
+
+from sjconfparts.conf import Conf
+from sjconfparts.resolver import Resolver
+
+
+def conf_to_dict(conf):
+    return dict(
+        [(section_name, dict(section.dict)) for (section_name, section) in conf.items()]
+    )
+
+
+class TestResolver(unittest.TestCase):
+    def setUp(self):
+        self.resolver = Resolver()
+        self.resolver["base"] = Conf(
+            {"environment": {"paths": "", "shell": "sh"}, "other": {"key": "base"}}
+        )
+        self.resolver["profile"] = Conf({"environment": {"shell": "bash"}})
+        self.resolver["local"] = Conf({"environment": {"paths": "/bin"}})
+
+    def assertPatched(self, layers=Resolver.LAYERS):
+        self.assertEqual(
+            conf_to_dict(self.resolver.merged(layers)),
+            conf_to_dict(self.resolver._merge(layers)),
+        )
+
+    def test_01_merged(self):
+        conf = self.resolver.merged()
+        self.assertEqual(conf["environment"]["paths"], "/bin")
+        self.assertEqual(conf["environment"]["shell"], "bash")
+        self.assertEqual(conf["other"]["key"], "base")
+        self.assertTrue(self.resolver.merged() is conf)
+
+    def test_02_layers_not_modified(self):
+        self.resolver.merged()
+        self.assertEqual(self.resolver["base"]["environment"]["paths"], "")
+        self.assertEqual(self.resolver["profile"]["environment"].dict, {"shell": "bash"})
+
+    def test_03_patch_key(self):
+        conf = self.resolver.merged()
+        self.resolver["local"]["environment"]["shell"] = "zsh"
+        self.resolver["local"]["environment"]["paths"] = "/usr/bin"
+        self.assertTrue(self.resolver.merged() is conf)
+        self.assertPatched()
+        del self.resolver["local"]["environment"]["shell"]
+        self.assertEqual(self.resolver.merged()["environment"]["shell"], "bash")
+        self.assertPatched()
+
+    def test_04_patch_section(self):
+        self.resolver.merged()
+        base_conf = self.resolver.merged(("base", "profile"))
+        self.resolver["local"]["new"] = {"key": "value"}
+        del self.resolver["local"]["environment"]
+        self.assertPatched()
+        self.resolver["local"].setdefault("other", Conf.ConfSection())
+        self.resolver["local"]["other"]["key"] = "local"
+        self.assertPatched()
+        self.assertTrue(self.resolver.merged(("base", "profile")) is base_conf)
+        self.assertEqual(base_conf["other"]["key"], "base")
+
+    def test_05_replace_layer(self):
+        self.resolver.merged()
+        self.resolver["local"] = Conf({"other": {"key": "new"}})
+        self.assertPatched()
+
+    def test_06_sections(self):
+        self.resolver["base"]["environment:extra"] = {"key": "base"}
+        view = self.resolver.sections("environment")
+        self.assertTrue(self.resolver.sections("environment") is view)
+        self.assertEqual(list(view), ["environment", "environment:extra"])
+        self.assertTrue(view["environment"] is self.resolver.merged()["environment"])
+        self.assertFalse("environment" in self.resolver.sections("env"))
+        view.set_type("environment:new", "key", "list")
+        # The view follows the patches and the rebuilds of the merged view
+        self.resolver["local"]["environment:new"] = {"key": "a, b"}
+        del self.resolver["base"]["environment:extra"]
+        self.assertEqual(list(view), ["environment", "environment:new"])
+        self.assertEqual(list(view["environment:new"]["key_list"]), ["a", "b"])
+        self.resolver["profile"] = Conf({"environment": {"shell": "zsh"}})
+        self.assertEqual(view["environment"]["shell"], "zsh")
+        self.assertEqual(list(view["environment:new"]["key_list"]), ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
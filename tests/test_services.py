@@ -0,0 +1,98 @@
+#!/usr/bin/nosetests3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sjconfparts.exceptions import ServiceError
+from sjconfparts.service import ServiceExecutor
+
+# Logs its arguments, and fails for the units listed in $SYSTEMCTL_FAILING,
+# which "is-failed" reports as failed unless $SYSTEMCTL_NOT_FAILED is set
+FAKE_SYSTEMCTL = """\
+#!/bin/sh
+echo "$@" >> "$SYSTEMCTL_LOG"
+action=$1
+shift
+status=0
+for unit in "$@"; do
+    case " $SYSTEMCTL_FAILING " in
+        *" $unit "*)
+            if [ "$action" = is-failed ]; then
+                [ -n "$SYSTEMCTL_NOT_FAILED" ] && echo active || echo failed
+            else
+                echo "Job for $unit failed" >&2
+                status=1
+            fi
+            ;;
+        *)
+            [ "$action" = is-failed ] && echo active
+            ;;
+    esac
+done
+exit $status
+"""
+
+
+class TestServices(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix="sjconftest_")
+        self._log = self._tmpdir + "/systemctl.log"
+        with open(self._tmpdir + "/systemctl", "w") as f:
+            f.write(FAKE_SYSTEMCTL)
+        os.chmod(self._tmpdir + "/systemctl", 0o755)
+        self._environ = os.environ.copy()
+        os.environ["PATH"] = self._tmpdir + ":" + os.environ["PATH"]
+        os.environ["SYSTEMCTL_LOG"] = self._log
+        os.environ["SYSTEMCTL_FAILING"] = ""
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self._tmpdir)
+
+    def calls(self):
+        with open(self._log) as f:
+            return [line.split() for line in f]
+
+    def test_01_waves(self):
+        executor = ServiceExecutor()
+        self.assertEqual(
+            executor.waves(
+                ("a", "b", "c", "d"), (("b", "a"), ("c", "b"), ("c", "e"))
+            ),
+            [["c", "d"], ["b"], ["a"]],
+        )
+        self.assertEqual(
+            executor.waves(("a", "b", "c"), (("a", "b"), ("b", "a"))),
+            [["c"], ["a", "b"]],
+        )
+
+    def test_02_run(self):
+        ServiceExecutor().run("restart", ("a", "b", "c"), (("c", "a"),))
+        self.assertEqual(self.calls(), [["restart", "b", "c"], ["restart", "a"]])
+
+    def test_03_failure(self):
+        os.environ["SYSTEMCTL_FAILING"] = "b"
+        with self.assertRaises(ServiceError) as context:
+            ServiceExecutor().run("restart", ("a", "b", "c"), (("b", "c"),))
+        self.assertEqual(list(context.exception.failures.keys()), ["b"])
+        # The failing units are queried, the action is not run again, and
+        # services ordered after a failed one are still run
+        self.assertEqual(
+            self.calls(),
+            [["restart", "a", "b"], ["is-failed", "a", "b"], ["restart", "c"]],
+        )
+
+    def test_04_failure_not_failed(self):
+        # A failed reload leaves the unit active: the wave is reported
+        os.environ["SYSTEMCTL_FAILING"] = "b"
+        os.environ["SYSTEMCTL_NOT_FAILED"] = "1"
+        with self.assertRaises(ServiceError) as context:
+            ServiceExecutor().run("reload", ("a", "b"))
+        self.assertEqual(sorted(context.exception.failures.keys()), ["a", "b"])
+        self.assertEqual(self.calls(), [["reload", "a", "b"], ["is-failed", "a", "b"]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/nosetests3
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SJCONF_CONF = """\
+[conf]
+backup_dir = %(tmpdir)s/var/backups/sjconf/
+base_dir = %(tmpdir)s/etc/sjconf
+etc_dir = %(tmpdir)s/etc
+plugins =
+plugins_path = %(tmpdir)s/var/lib/sjconf/plugins
+templates_path = %(tmpdir)s/etc/sjconf/templates/
+"""
+
+LOCAL_CONF = """\
+[environment]
+paths = /bin, /usr/bin
+"""
+
+# Reads local.conf as the read-only commands do, and prints the loaded modules
+READ_ONLY_COMMANDS = """\
+import json, sys
+import sjconf
+my_sjconf = sjconf.SJConf(sjconf_file_path=sys.argv[1])
+open(my_sjconf.conf_file_path("local")).read()
+my_sjconf.conf_local()["environment"]["paths"]
+print(json.dumps(sorted(sys.modules)))
+"""
+
+# Modules only needed to deploy, back up or run services
+SLOW_MODULES = (
+    "apt_pkg",
+    "concurrent.futures",
+    "hashlib",
+    "imp",
+    "shutil",
+    "sjconfparts.backup",
+    "sjconfparts.template",
+    "subprocess",
+    "tarfile",
+)
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix="sjconftest_")
+        self._sjconf_conf = self._tmpdir + "/etc/sjconf/sjconf.conf"
+        os.makedirs(self._tmpdir + "/etc/sjconf")
+        with open(self._sjconf_conf, "w") as f:
+            f.write(SJCONF_CONF % {"tmpdir": self._tmpdir})
+        with open(self._tmpdir + "/etc/sjconf/local.conf", "w") as f:
+            f.write(LOCAL_CONF)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_01_read_only_imports(self):
+        env = os.environ.copy()
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(
+            [sys.executable, "-c", READ_ONLY_COMMANDS, self._sjconf_conf], env=env
+        )
+        modules = json.loads(output)
+        self.assertEqual([module for module in SLOW_MODULES if module in modules], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/nosetests3
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from sjconfparts.exceptions import *
+from sjconfparts.plugin import PluginWithTemplate
+from sjconfparts.template import *
+
+TEMPLATE = """\
+upstream {{ name }} {
+{% for (i, server) in enumerate(servers_list) %}
+    server {{ server }}{% if i == 0 %} backup{% endif %};
+{% endfor %}
+{# comment #}
+{% if len(servers_list) > 1 %}
+    keepalive {{ conf["keepalive"] }};
+{% elif servers_list %}
+    keepalive 1;
+{% else %}
+    # no server
+{% endif %}
+}
+"""
+
+
+class TestTemplate(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix="sjconftest_")
+        self._template = self._tmpdir + "/upstream.tmpl"
+        with open(self._template, "w") as f:
+            f.write(TEMPLATE)
+        self.engine = TemplateEngine.engine("compiled", self._tmpdir + "/cache")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def render(self, servers):
+        compiled = self.engine.compile(TEMPLATE, self._template)
+        return self.engine.render(
+            compiled, {"name": "app", "servers_list": servers, "keepalive": "8"}
+        )
+
+    def test_01_render(self):
+        self.assertEqual(
+            self.render(["a", "b"]),
+            "upstream app {\n"
+            "    server a backup;\n"
+            "    server b;\n"
+            "\n"
+            "    keepalive 8;\n"
+            "}\n",
+        )
+        self.assertEqual(
+            self.render(["a"]),
+            "upstream app {\n    server a backup;\n\n    keepalive 1;\n}\n",
+        )
+        self.assertEqual(self.render([]), "upstream app {\n\n    # no server\n}\n")
+
+    def test_02_disk_cache(self):
+        self.render([])
+        self.assertEqual(len(os.listdir(self._tmpdir + "/cache")), 1)
+        # A second engine loads the code object from the disk cache
+        engine = TemplateEngine.engine("compiled", self._tmpdir + "/cache")
+        compiled = engine.compile(TEMPLATE, self._template)
+        self.assertEqual(
+            engine.render(compiled, {"name": "x", "servers_list": []}),
+            "upstream x {\n\n    # no server\n}\n",
+        )
+        # A modified template replaces its former code
+        compiled = engine.compile("{{ name }}\n", self._template)
+        self.assertEqual(engine.render(compiled, {"name": "x"}), "x\n")
+        self.assertEqual(len(os.listdir(self._tmpdir + "/cache")), 1)
+        with self.assertRaises(TypeError):
+            TemplateEngine()
+
+    def test_03_errors(self):
+        for (template, line_number) in (
+            ("{% for server in servers %}\n", 1),
+            ("a\n{% endif %}\n", 2),
+            ("{{ 1 + }}", 1),
+            ("{% while true %}", 1),
+            ("{% if a %}{% else %}{% elif b %}{% endif %}", 1),
+        ):
+            with self.assertRaises(TemplateError) as context:
+                self.engine.compile(template, self._template)
+            self.assertEqual(context.exception.line_number, line_number)
+        compiled = self.engine.compile("a\n{{ missing }}\n", self._template)
+        with self.assertRaises(TemplateError) as context:
+            self.engine.render(compiled, {})
+        self.assertEqual(context.exception.line_number, 2)
+        with self.assertRaises(TemplateEngineNotFoundError):
+            TemplateEngine.engine("unknown")
+
+    def test_04_plugin_template(self):
+        compiled = PluginWithTemplate.template(self._template, self.engine)
+        self.assertIs(
+            PluginWithTemplate.template(self._template, self.engine), compiled
+        )
+        self.assertEqual(PluginWithTemplate.template(self._template), TEMPLATE)
+
+
+    def test_05_private_cache(self):
+        cache_path = self._tmpdir + "/cache"
+        self.render([])
+        self.assertEqual(stat.S_IMODE(os.stat(cache_path).st_mode), 0o700)
+        [cache_file] = os.listdir(cache_path)
+        cache_file_path = cache_path + "/" + cache_file
+        self.assertEqual(stat.S_IMODE(os.stat(cache_file_path).st_mode), 0o600)
+        engine = TemplateEngine.engine("compiled", cache_path)
+        source_hash = engine._hash(
+            "%d\0%s\0%s" % (engine.VERSION, self._template, TEMPLATE)
+        ).digest()
+        self.assertIsNotNone(engine._cache_load(cache_file_path, source_hash))
+        # Code not written by the current user is not loaded
+        os.chown(cache_file_path, 1, 1)
+        self.assertIsNone(engine._cache_load(cache_file_path, source_hash))
+        os.chown(cache_file_path, os.geteuid(), os.getegid())
+        os.chown(cache_path, 1, 1)
+        self.assertFalse(TemplateEngine.engine("compiled", cache_path)._cache_usable())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -138,6 +138,20 @@ class TestClass(unittest.TestCase):
         unjsoned = json.loads(json.dumps(typed_conf))
         assert typed_conf == unjsoned
 
+    def test_07_conf_copies(self):
+        conf = self.conf.conf()
+        conf["environment"].set_type("paths", "list")
+        conf["environment"]["paths_list"] = ["/sbin"]
+        assert self.conf.conf()["environment"]["paths"] == "/bin, /usr/bin"
+        plugin_conf = self.conf.plugin_conf("environment")
+        plugin_conf["environment"]["paths"] = "/sbin"
+        assert self.conf.plugin_conf("environment")["environment"]["paths"] == (
+            "/bin, /usr/bin"
+        )
+        conf_base = self.conf.conf_base()
+        conf_base["environment"]["paths"] = "/sbin"
+        assert self.conf.conf_base()["environment"]["paths"] == ""
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/nosetests3
+
+import random
+import unittest
+
+from sjconfparts.conf import Conf
+from sjconfparts.type import Type
+
+
+class Diverged(Exception):
+    pass
+
+
+def assign_elts_reference(elts, assignments_old, indices_unassigned):
+    """Former quadratic implementation of Type.Sequence.assign_elts.
+
+    Kept as is, except for a guard against the inputs on which it never
+    terminated.
+    """
+
+    def _assign_unassigned(
+        indices, elts_unassigned, indices_unassigned, index_prev, index
+    ):
+        indices_available = [
+            index_unassigned
+            for index_unassigned in indices_unassigned
+            if index_unassigned > index_prev
+            and (index_unassigned < index or index < -1)
+        ]
+        for index_available in indices_available:
+            indices_unassigned.remove(index_available)
+        while len(indices_available) > len(elts_unassigned) - (
+            index >= -1 and 1 or 0
+        ):
+            indices_available.pop()
+        indices_available.append(index)
+        indices_to_assign = []
+        for index_available in indices_available:
+            while len(indices_to_assign) < len(elts_unassigned) - (
+                index_available >= -1 and 1 or 0
+            ):
+                if index_prev < index_available - 1 or index_available < -1:
+                    index_prev += 1
+                    indices_to_assign.append(index_prev)
+                else:
+                    raise Diverged()
+            if index_available >= -1:
+                indices_to_assign.append(index_available)
+                index_prev = index_available
+        while len(elts_unassigned) > 0:
+            elts_unassigned.pop(0)
+            index_prev = indices_to_assign.pop(0)
+            indices.append(index_prev)
+        return index_prev
+
+    elts_unassigned = []
+    indices = []
+    index_prev = 0
+    for elt in elts:
+        elts_unassigned.append(elt)
+        if elt in assignments_old:
+            index = assignments_old[elt]
+            if index > index_prev and (
+                len(elts_unassigned) == 1 or len(elts_unassigned) <= index - index_prev
+            ):
+                index_prev = _assign_unassigned(
+                    indices,
+                    elts_unassigned,
+                    indices_unassigned,
+                    index_prev,
+                    index,
+                )
+    index_prev = _assign_unassigned(
+        indices, elts_unassigned, indices_unassigned, index_prev, -2
+    )
+    return indices
+
+
+class TestSequence(unittest.TestCase):
+    def random_sequence(self, rand):
+        """Returns a random sequence, as stored in a configuration section."""
+        indices = rand.sample(range(1, 60), rand.randint(0, 25))
+        values = ["value%d" % rand.randint(0, 30) for index in indices]
+        dict_str = {}
+        for (index, value) in zip(indices, values):
+            dict_str["key-%d" % (index)] = value if rand.random() > 0.2 else ""
+        return dict_str
+
+    def random_elts(self, rand, dict_str):
+        elts = [value for value in dict_str.values() if value != ""]
+        rand.shuffle(elts)
+        for i in range(rand.randint(0, 5)):
+            elts.insert(
+                rand.randint(0, len(elts)), "value%d" % rand.randint(0, 40)
+            )
+        for i in range(rand.randint(0, min(3, len(elts)))):
+            elts.pop(rand.randint(0, len(elts) - 1))
+        return elts
+
+    def test_01_assign_elts_equivalence(self):
+        rand = random.Random(42)
+        compared = 0
+        for i in range(5000):
+            dict_str = self.random_sequence(rand)
+            elts = self.random_elts(rand, dict_str)
+            assignments_old = {}
+            indices_unassigned = []
+            for str_key in sorted(
+                dict_str, key=lambda str_key: Type.Sequence.key_to_index("key", str_key)
+            ):
+                index = Type.Sequence.key_to_index("key", str_key)
+                if dict_str[str_key] == "":
+                    indices_unassigned.append(index)
+                else:
+                    assignments_old[dict_str[str_key]] = index
+            indices = Type.Sequence.assign_elts(
+                elts, assignments_old, list(reversed(indices_unassigned))
+            )
+            self.assertEqual(len(indices), len(elts))
+            self.assertEqual(len(set(indices)), len(indices))
+            try:
+                indices_reference = assign_elts_reference(
+                    elts, assignments_old, list(indices_unassigned)
+                )
+            except Diverged:
+                continue
+            self.assertEqual(indices, indices_reference)
+            compared += 1
+        self.assertTrue(compared > 4000)
+
+    def test_02_sequence_to_str_keeps_indices(self):
+        dict_str = {"key-1": "a", "key-5": "b", "key-9": "c", "key-10": ""}
+        Type.Sequence.sequence_to_str({"key": ["a", "x", "b", "c", "y"]}, dict_str, "key")
+        self.assertEqual(
+            dict_str,
+            {"key-1": "a", "key-2": "x", "key-5": "b", "key-9": "c", "key-10": "y"},
+        )
+
+    def test_03_sequence_round_trip(self):
+        rand = random.Random(7)
+        for i in range(500):
+            dict_str = self.random_sequence(rand)
+            elts = self.random_elts(rand, dict_str)
+            Type.Sequence.sequence_to_str({"key": elts}, dict_str, "key")
+            # Empty values mask the values of lower configuration levels
+            self.assertEqual(
+                [
+                    elt
+                    for elt in Type.Sequence.str_to_sequence_safe(dict_str, {}, "key")[
+                        "key"
+                    ]
+                    if elt != ""
+                ],
+                elts,
+            )
+
+    def test_04_batch(self):
+        section = Conf.ConfSection({"key-1": "a", "key-3": "b"})
+        section.set_type("key", "sequence")
+        with section.batch():
+            sequence = section["key_sequence"]
+            for value in ("c", "d", "e"):
+                sequence.append(value)
+            self.assertFalse("key-4" in section)
+        self.assertEqual(
+            section.dict,
+            {"key-1": "a", "key-3": "b", "key-4": "c", "key-5": "d", "key-6": "e"},
+        )
+        with sequence.batch():
+            sequence.remove("a")
+            self.assertEqual(section.dict["key-1"], "a")
+        self.assertFalse("key-1" in section)
+
+
+if __name__ == "__main__":
+    unittest.main()